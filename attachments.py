@@ -0,0 +1,109 @@
+"""Content-addressed attachment store.
+
+Uploads are streamed to a temp file while being hashed, then moved to
+objects/<sha[:2]>/<sha>. Identical uploads share one file on disk.
+Thumbnails for raster images are generated in a process pool (needs Pillow,
+which is in requirements.txt; without it, thumbnails are simply skipped).
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Optional, Tuple
+import asyncio
+import hashlib
+import os
+import tempfile
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Content-Type comes from the uploader, so only these are ever rendered inline
+# or thumbnailed. Everything else (HTML, SVG, ...) is treated as an opaque file.
+RASTER_IMAGE_TYPES = {"image/png", "image/jpeg", "image/gif", "image/webp"}
+
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_WORKERS = 2
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+def is_raster_image(content_type: str) -> bool:
+    return content_type.split(";")[0].strip().lower() in RASTER_IMAGE_TYPES
+
+
+def make_thumbnail(source: str, destination: str):
+    """Write a JPEG thumbnail of `source` (runs in a worker process)."""
+    with Image.open(source) as image:
+        image.thumbnail(THUMBNAIL_SIZE)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        tmp = destination + ".tmp"
+        image.save(tmp, "JPEG", quality=80)
+    os.replace(tmp, destination)
+
+
+class AttachmentStore:
+    def __init__(self, root: str):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.thumbs_dir = os.path.join(root, "thumbs")
+        self.tmp_dir = os.path.join(root, "tmp")
+        for directory in (self.objects_dir, self.thumbs_dir, self.tmp_dir):
+            os.makedirs(directory, exist_ok=True)
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def object_path(self, sha256: str) -> str:
+        return os.path.join(self.objects_dir, sha256[:2], sha256)
+
+    def thumbnail_path(self, sha256: str) -> str:
+        return os.path.join(self.thumbs_dir, sha256 + ".jpg")
+
+    async def save_stream(self, chunks: AsyncIterator[bytes], max_size: int) -> Tuple[str, int]:
+        """Write an upload to disk chunk by chunk. Returns (sha256, size)."""
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > max_size:
+                        raise AttachmentTooLarge()
+                    hasher.update(chunk)
+                    f.write(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        sha256 = hasher.hexdigest()
+        path = self.object_path(sha256)
+        if os.path.exists(path):
+            os.remove(tmp_path)  # Already stored - dedupe
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        return sha256, size
+
+    def schedule_thumbnail(self, sha256: str, content_type: str):
+        """Generate a thumbnail in the background for raster image uploads."""
+        if Image is None or not is_raster_image(content_type):
+            return
+        destination = self.thumbnail_path(sha256)
+        if os.path.exists(destination):
+            return
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+        future = asyncio.get_running_loop().run_in_executor(
+            self._pool, make_thumbnail, self.object_path(sha256), destination)
+        future.add_done_callback(self._log_thumbnail_error)
+
+    @staticmethod
+    def _log_thumbnail_error(future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            print(f"Thumbnail generation failed: {future.exception()}")
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,140 @@
+"""In-process chat server for benchmarks.
+
+Starts server.py under uvicorn in a background thread, inside a temp
+directory (so chat.db, uploads/ and static/ are throwaway), and gives
+scenarios helpers for HTTP calls, WebSocket clients and bulk seeding.
+"""
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import uvicorn
+import websockets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BENCH_PASSWORD = "benchmark-password"
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(samples: list, wall_seconds: float = None) -> dict:
+    """Latency stats (ms) for per-operation timings in seconds, plus throughput if wall time given."""
+    result = {
+        "count": len(samples),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3),
+    }
+    if wall_seconds:
+        result["ops_per_sec"] = round(len(samples) / wall_seconds, 2)
+    return result
+
+
+class ChatServerHarness:
+    def __init__(self):
+        self.tmp = tempfile.TemporaryDirectory(prefix="chat-bench-")
+        self.server = None
+        self.port = None
+        self._uvicorn = None
+        self._thread = None
+        self._cwd = None
+        self._password_hash = None
+
+    def start(self):
+        # server.py resolves chat.db, uploads/ and static/ relative to cwd at import
+        self._cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        if ROOT not in sys.path:
+            sys.path.insert(0, ROOT)
+        import server
+        self.server = server
+        # Setup opens hundreds of sockets back to back; don't let the admission gate pace it
+        server.admission = server.ConnectionAdmission(rate=1e6, burst=10 ** 6, max_pending=10 ** 6)
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("127.0.0.1", 0))
+        self.port = sock.getsockname()[1]
+        config = uvicorn.Config(server.app, log_level="warning", timeout_graceful_shutdown=2)
+        self._uvicorn = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._uvicorn.run, kwargs={"sockets": [sock]}, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._uvicorn.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Benchmark server did not start")
+            time.sleep(0.01)
+
+    def stop(self):
+        if self._uvicorn is not None:
+            self._uvicorn.should_exit = True
+            self._thread.join(timeout=10)
+        if self._cwd is not None:
+            os.chdir(self._cwd)
+        self.tmp.cleanup()
+
+    # --- Seeding (bypasses the API so setup doesn't pay for bcrypt) ---
+
+    def create_users(self, names: list) -> dict:
+        """Create users directly in storage; returns {username: token}."""
+        if self._password_hash is None:
+            self._password_hash = self.server.hash_password(BENCH_PASSWORD)
+        tokens = {}
+        for name in names:
+            self.server.storage.create_user(name, self._password_hash, self._password_hash)
+            tokens[name] = self.server.create_access_token(name)
+        return tokens
+
+    def bulk_insert(self, query: str, rows: list):
+        """executemany straight into the server's SQLite database."""
+        conn = sqlite3.connect(self.server.DB_NAME)
+        conn.executemany(query, rows)
+        conn.commit()
+        conn.close()
+
+    # --- HTTP ---
+
+    def _http(self, method: str, path: str, body: dict = None) -> tuple:
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{self.port}{path}", data=data, method=method,
+            headers={"Content-Type": "application/json"} if data else {})
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                return response.status, json.loads(response.read() or b"null")
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+    async def http(self, method: str, path: str, body: dict = None) -> tuple:
+        """(status, parsed JSON) - runs the blocking client in a worker thread."""
+        return await asyncio.to_thread(self._http, method, path, body)
+
+    # --- WebSocket ---
+
+    async def connect(self, username: str, token: str):
+        return await websockets.connect(
+            f"ws://127.0.0.1:{self.port}/ws/{username}?token={token}", max_size=None)
+
+
+@contextlib.contextmanager
+def running_server():
+    harness = ChatServerHarness()
+    harness.start()
+    try:
+        yield harness
+    finally:
+        harness.stop()
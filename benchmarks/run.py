@@ -0,0 +1,145 @@
+"""End-to-end benchmark suite for the chat server.
+
+Runs server.py in-process against a temp database and writes the results
+as JSON, so every performance change can show a before/after diff:
+
+    python benchmarks/run.py --quick -o before.json
+    # ...make a change...
+    python benchmarks/run.py --quick -o after.json --compare before.json
+    python benchmarks/run.py --diff before.json after.json
+
+Use --only auth,messaging,offline,presence,history to pick scenarios.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import running_server
+from scenarios import FULL, QUICK, SCENARIOS
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(names: list, quick: bool) -> dict:
+    config = QUICK if quick else FULL
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mode": "quick" if quick else "full",
+            "config": config,
+        },
+        "results": {},
+    }
+    progress = sys.stdout
+    with running_server() as harness:
+        # The server prints a line per message/connection; keep that out of the report
+        sys.stdout = open(os.devnull, "w")
+        try:
+            for name in names:
+                progress.write(f"running {name}...\n")
+                progress.flush()
+                report["results"].update(asyncio.run(SCENARIOS[name](harness, config)))
+        finally:
+            sys.stdout.close()
+            sys.stdout = progress
+    return report
+
+
+def print_results(report: dict):
+    for name, metrics in report["results"].items():
+        values = ", ".join(f"{k}={v}" for k, v in metrics.items())
+        print(f"{name:<32} {values}")
+
+
+def direction(metric: str) -> int:
+    """+1 if higher is better, -1 if lower is better, 0 if not comparable."""
+    if metric.endswith("_per_sec"):
+        return 1
+    if metric.endswith(("_ms", "_s")):
+        return -1
+    return 0
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> int:
+    """Print a before/after table; returns the number of regressions beyond threshold %."""
+    regressions = 0
+    if baseline["meta"]["mode"] != current["meta"]["mode"]:
+        print(f"warning: comparing a {baseline['meta']['mode']} run against a {current['meta']['mode']} run")
+    print(f"baseline {baseline['meta']['commit']} -> current {current['meta']['commit']}")
+    print(f"{'result':<32} {'metric':<18} {'before':>12} {'after':>12} {'change':>9}")
+    for name, metrics in current["results"].items():
+        before_metrics = baseline["results"].get(name)
+        if before_metrics is None:
+            print(f"{name:<32} (new)")
+            continue
+        for metric, after in metrics.items():
+            before = before_metrics.get(metric)
+            sign = direction(metric)
+            if not sign or not isinstance(before, (int, float)) or not before:
+                continue
+            change = (after - before) / before * 100
+            flag = ""
+            if change * sign < -threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            elif change * sign > threshold:
+                flag = "  improved"
+            print(f"{name:<32} {metric:<18} {before:>12} {after:>12} {change:>+8.1f}%{flag}")
+    for name in baseline["results"]:
+        if name not in current["results"]:
+            print(f"{name:<32} (missing)")
+    return regressions
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end chat server benchmarks")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes (about a minute)")
+    parser.add_argument("--only", help="comma-separated scenarios: " + ",".join(SCENARIOS))
+    parser.add_argument("-o", "--output", default="bench_results.json", help="where to write the JSON report")
+    parser.add_argument("--compare", metavar="BASELINE", help="diff this run against a previous report")
+    parser.add_argument("--diff", nargs=2, metavar=("BEFORE", "AFTER"), help="diff two reports without running")
+    parser.add_argument("--threshold", type=float, default=10.0, help="%% change flagged as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit 1 if anything regressed")
+    args = parser.parse_args()
+
+    if args.diff:
+        regressions = compare(load(args.diff[0]), load(args.diff[1]), args.threshold)
+    else:
+        names = args.only.split(",") if args.only else list(SCENARIOS)
+        unknown = [n for n in names if n not in SCENARIOS]
+        if unknown:
+            parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+        report = run(names, args.quick)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print_results(report)
+        print(f"wrote {args.output}")
+        regressions = compare(load(args.compare), report, args.threshold) if args.compare else 0
+
+    if args.fail_on_regression and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""End-to-end benchmark scenarios.
+
+Each scenario takes the running harness and a size config and returns
+{result_name: {metric: value}}. Metric suffixes tell `compare` which way
+is better: *_ms / *_s lower, *_per_sec higher.
+"""
+import asyncio
+import json
+import time
+
+from harness import BENCH_PASSWORD, summarize
+
+QUICK = {
+    "auth_users": 8,
+    "auth_concurrency": 4,
+    "messages": 200,
+    "offline_backlogs": [10, 100, 1000],
+    "presence_connections": [10, 50],
+    "data_sizes": [1000, 10000],
+    "repeat": 20,
+}
+
+FULL = {
+    "auth_users": 32,
+    "auth_concurrency": 8,
+    "messages": 2000,
+    "offline_backlogs": [10, 100, 1000],  # 1000 = the server's OFFLINE_QUEUE_MAX
+    "presence_connections": [10, 100, 500],
+    "data_sizes": [1000, 10000, 100000],
+    "repeat": 50,
+}
+
+
+async def _timed_calls(calls: list, concurrency: int) -> tuple:
+    """Run coroutine factories with bounded concurrency; returns (latencies, wall seconds)."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def run(call):
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(call) for call in calls))
+    return latencies, time.perf_counter() - start
+
+
+async def _recv_json(ws) -> dict:
+    return json.loads(await ws.recv())
+
+
+async def bench_auth(h, cfg: dict) -> dict:
+    """Register/login throughput (bcrypt-bound)."""
+    names = [f"auth{i:05d}" for i in range(cfg["auth_users"])]
+
+    def register(name):
+        async def call():
+            status, _ = await h.http("POST", "/api/register", {
+                "username": name, "password": BENCH_PASSWORD, "confirm_password": BENCH_PASSWORD})
+            assert status == 200, status
+        return call
+
+    def login(name):
+        async def call():
+            status, _ = await h.http("POST", "/api/login", {"username": name, "password": BENCH_PASSWORD})
+            assert status == 200, status
+        return call
+
+    register_lat, register_wall = await _timed_calls([register(n) for n in names], cfg["auth_concurrency"])
+    login_lat, login_wall = await _timed_calls([login(n) for n in names], cfg["auth_concurrency"])
+    return {
+        "auth.register": summarize(register_lat, register_wall),
+        "auth.login": summarize(login_lat, login_wall),
+    }
+
+
+async def bench_messaging(h, cfg: dict) -> dict:
+    """1:1 message latency (one at a time) and throughput (pipelined) over /ws."""
+    tokens = h.create_users(["msg_sender", "msg_receiver"])
+    sender = await h.connect("msg_sender", tokens["msg_sender"])
+    receiver = await h.connect("msg_receiver", tokens["msg_receiver"])
+
+    async def next_message():
+        while True:
+            data = await _recv_json(receiver)
+            if data.get("from") == "msg_sender":
+                return data
+
+    count = cfg["messages"]
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        await sender.send(json.dumps({"to": "msg_receiver", "message": f"latency {i}"}))
+        await next_message()
+        latencies.append(time.perf_counter() - start)
+
+    async def send_all():
+        for i in range(count):
+            await sender.send(json.dumps({"to": "msg_receiver", "message": f"throughput {i}"}))
+
+    async def receive_all():
+        for _ in range(count):
+            await next_message()
+
+    start = time.perf_counter()
+    await asyncio.gather(send_all(), receive_all())
+    wall = time.perf_counter() - start
+
+    await sender.close()
+    await receiver.close()
+    return {
+        "messaging.latency": summarize(latencies),
+        "messaging.throughput": {"count": count, "ops_per_sec": round(count / wall, 2)},
+    }
+
+
+async def bench_offline_catchup(h, cfg: dict) -> dict:
+    """Time from connect until a recipient has its whole offline backlog."""
+    results = {}
+    # Seeding bypasses handle_message, so clamp to the cap: bigger backlogs can't happen
+    sizes = sorted({min(size, h.server.OFFLINE_QUEUE_MAX) for size in cfg["offline_backlogs"]})
+    for size in sizes:
+        recipient = f"offline_{size}"
+        tokens = h.create_users([recipient, f"{recipient}_sender"])
+        h.bulk_insert(
+            "INSERT INTO messages (sender, recipient, content, is_delivered) VALUES (?, ?, ?, 0)",
+            [(f"{recipient}_sender", recipient, f"queued {i}") for i in range(size)])
+
+        start = time.perf_counter()
+        ws = await h.connect(recipient, tokens[recipient])
+        received = 0
+        mode = "push"
+        while received < size:
+            data = await _recv_json(ws)
+            if data.get("offline_catchup"):
+                received += 1
+            elif data.get("type") == "offline_digest":
+                # Large backlog: page through /api/offline like the frontend does
+                mode = "digest"
+                remaining = True
+                while remaining:
+                    status, page = await h.http("GET", f"/api/offline/{recipient}?token={tokens[recipient]}")
+                    assert status == 200, status
+                    received += len(page["messages"])
+                    remaining = page["remaining"] > 0 and page["messages"]
+                break
+        elapsed = time.perf_counter() - start
+        await ws.close()
+
+        results[f"offline_catchup.backlog_{size}"] = {
+            "count": received,
+            "mode": mode,
+            "total_s": round(elapsed, 4),
+            "per_message_ms": round(elapsed / max(received, 1) * 1000, 4),
+        }
+    return results
+
+
+class PresenceClient:
+    """Connected client that watches online_users frames for a target user."""
+
+    def __init__(self, ws, tracker: dict):
+        self.ws = ws
+        self.tracker = tracker
+        self.acknowledged = None
+        self.task = asyncio.create_task(self.read())
+
+    async def read(self):
+        try:
+            async for raw in self.ws:
+                data = json.loads(raw)
+                target = self.tracker["target"]
+                if (data.get("type") == "online_users" and target in data["users"]
+                        and self.acknowledged != target):
+                    self.acknowledged = target
+                    self.tracker["remaining"] -= 1
+                    if self.tracker["remaining"] == 0:
+                        self.tracker["done"].set()
+        except Exception:
+            pass
+
+
+async def bench_presence(h, cfg: dict) -> dict:
+    """Time for a new connection's presence broadcast to reach N connected clients."""
+    results = {}
+    tracker = {"target": None, "remaining": 0, "done": asyncio.Event()}
+    clients = []
+    for size in cfg["presence_connections"]:
+        names = [f"presence{i:05d}" for i in range(len(clients), size)]
+        tokens = h.create_users(names)
+        for name in names:
+            clients.append(PresenceClient(await h.connect(name, tokens[name]), tracker))
+        await asyncio.sleep(0.2)  # Let setup broadcasts settle
+
+        probe = f"probe{size:05d}"
+        probe_token = h.create_users([probe])[probe]
+        tracker.update(target=probe, remaining=len(clients), done=asyncio.Event())
+        start = time.perf_counter()
+        probe_ws = await h.connect(probe, probe_token)
+        await asyncio.wait_for(tracker["done"].wait(), timeout=120)
+        elapsed = time.perf_counter() - start
+        # The probe stays connected and becomes part of the next population
+        clients.append(PresenceClient(probe_ws, tracker))
+
+        results[f"presence.connections_{size}"] = {
+            "count": size,
+            "broadcast_ms": round(elapsed * 1000, 3),
+            "per_connection_ms": round(elapsed * 1000 / size, 4),
+        }
+
+    for client in clients:
+        await client.ws.close()
+        client.task.cancel()
+    return results
+
+
+async def bench_history_search(h, cfg: dict) -> dict:
+    """/api/history and /api/search latency as the tables grow."""
+    results = {}
+    target = "history_user"
+    h.create_users([target])
+    messages = 0
+    users = 0
+    for size in cfg["data_sizes"]:
+        # Grow both tables to `size` rows; the target takes part in ~10% of messages
+        h.bulk_insert(
+            "INSERT INTO messages (sender, recipient, content, is_delivered) VALUES (?, ?, ?, 1)",
+            [(target if i % 10 == 0 else f"user{i % 997:05d}", f"user{(i * 7) % 991:05d}", f"history {i}")
+             for i in range(messages, size)])
+        h.bulk_insert(
+            "INSERT INTO users (username, password_hash) VALUES (?, 'x')",
+            [(f"search{i:07d}",) for i in range(users, size)])
+        messages = users = size
+
+        history = []
+        for _ in range(cfg["repeat"]):
+            start = time.perf_counter()
+            status, _ = await h.http("GET", f"/api/history/{target}")
+            history.append(time.perf_counter() - start)
+            assert status == 200, status
+        search = []
+        for i in range(cfg["repeat"]):
+            start = time.perf_counter()
+            status, _ = await h.http("GET", f"/api/search?q=SEARCH{i % 100:02d}")
+            search.append(time.perf_counter() - start)
+            assert status == 200, status
+
+        results[f"history.rows_{size}"] = summarize(history)
+        results[f"search.rows_{size}"] = summarize(search)
+    return results
+
+
+SCENARIOS = {
+    "auth": bench_auth,
+    "messaging": bench_messaging,
+    "offline": bench_offline_catchup,
+    "presence": bench_presence,
+    "history": bench_history_search,
+}
@@ -0,0 +1,102 @@
+"""Requests/sec on the static asset routes.
+
+Drives the ASGI app directly (no sockets) against a throwaway build in a
+temp directory, so the numbers reflect server-side cost only.
+
+    python benchmarks/static_assets.py [--requests 2000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ASSET_NAME = "index-B3x9aQz1.js"
+
+
+def make_build(directory: str):
+    """Write a fake Vite build: index.html plus one ~350KB hashed JS bundle."""
+    os.makedirs(os.path.join(directory, "static", "assets"))
+    with open(os.path.join(directory, "static", "index.html"), "w") as f:
+        f.write('<!doctype html><html><head><script type="module" src="/assets/%s"></script>'
+                '</head><body><div id="root"></div></body></html>' % ASSET_NAME)
+    with open(os.path.join(directory, "static", "assets", ASSET_NAME), "w") as f:
+        for i in range(5000):
+            f.write("export function component%d(props) { return props.value + %d; }\n" % (i, i))
+
+
+async def request(app, path: str, headers: dict) -> tuple:
+    """Issue one GET through the ASGI interface; return (status, headers, body size)."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "root_path": "", "server": ("bench", 80), "client": ("bench", 1),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+    }
+    response = {"status": 0, "headers": {}, "size": 0}
+    requested = False
+    finished = asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await finished.wait()  # Like a real server: disconnect once the body is sent
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {k.decode(): v.decode() for k, v in message["headers"]}
+        elif message["type"] == "http.response.body":
+            response["size"] += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                finished.set()
+
+    await app(scope, receive, send)
+    return response["status"], response["headers"], response["size"]
+
+
+async def run(app, requests: int):
+    asset = "/assets/" + ASSET_NAME
+    # Grab the ETag once so we can measure the 304 path
+    _, headers, _ = await request(app, asset, {"Accept-Encoding": "gzip"})
+    revalidate = {"Accept-Encoding": "gzip", "If-None-Match": headers["etag"]}
+
+    scenarios = [
+        ("index.html", "/", {}),
+        ("index.html gzip", "/", {"Accept-Encoding": "gzip, br"}),
+        ("asset identity", asset, {}),
+        ("asset gzip", asset, {"Accept-Encoding": "gzip"}),
+        ("asset 304", asset, revalidate),
+        ("spa fallback", "/chat/alice", {}),
+    ]
+    print(f"{'route':<18} {'status':>6} {'bytes':>9} {'req/s':>10}")
+    for name, path, headers in scenarios:
+        status, _, size = await request(app, path, headers)
+        start = time.perf_counter()
+        for _ in range(requests):
+            await request(app, path, headers)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<18} {status:>6} {size:>9} {requests / elapsed:>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        make_build(tmp)
+        os.chdir(tmp)  # server.py resolves static/ and chat.db relative to cwd
+        sys.path.insert(0, ROOT)
+        import server
+        asyncio.run(run(server.app, args.requests))
+
+
+if __name__ == "__main__":
+    main()
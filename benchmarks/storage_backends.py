@@ -0,0 +1,87 @@
+"""Storage backend benchmark: the same workload against every engine.
+
+    python benchmarks/storage_backends.py [--users 200] [--messages 5000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import MemoryStorage, SQLiteStorage
+
+
+def timed(label: str, ops: int, fn) -> dict:
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    return {"op": label, "ops": ops, "seconds": elapsed, "ops_per_sec": ops / elapsed if elapsed else 0.0}
+
+
+def workload(storage, users: int, messages: int) -> list:
+    """Users, friendships, live/offline messages, catch-up, history and search."""
+    names = [f"user{i:05d}" for i in range(users)]
+    results = []
+
+    def create_users():
+        for name in names:
+            storage.create_user(name, "x" * 60, "y" * 60)
+
+    def befriend():
+        for i, name in enumerate(names):
+            other = names[(i + 1) % users]
+            storage.create_friend_request(name, other)
+            storage.accept_friend_request(name, other)
+
+    def send_messages():
+        for i in range(messages):
+            # Every third message goes to an "offline" recipient
+            storage.save_message(names[i % users], names[(i * 7 + 1) % users], f"message {i}", i % 3 != 0)
+
+    def catch_up():
+        for name in names:
+            storage.take_offline_messages(name)
+
+    def history():
+        for name in names:
+            storage.get_history(name)
+
+    def search():
+        for i in range(users):
+            storage.search_users(f"{i % 100:02d}")
+
+    def friends():
+        for name in names:
+            storage.get_friends(name)
+
+    results.append(timed("create_user", users, create_users))
+    results.append(timed("friend_request+accept", users, befriend))
+    results.append(timed("save_message", messages, send_messages))
+    results.append(timed("take_offline_messages", users, catch_up))
+    results.append(timed("get_history", users, history))
+    results.append(timed("search_users", users, search))
+    results.append(timed("get_friends", users, friends))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = [
+            ("sqlite", SQLiteStorage(os.path.join(tmp, "bench.db"))),
+            ("memory", MemoryStorage()),
+        ]
+        print(f"{'backend':<8} {'operation':<24} {'ops':>7} {'ops/s':>12}")
+        for name, storage in backends:
+            for result in workload(storage, args.users, args.messages):
+                print(f"{name:<8} {result['op']:<24} {result['ops']:>7} {result['ops_per_sec']:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
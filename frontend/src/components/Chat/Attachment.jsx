@@ -0,0 +1,69 @@
+import React, { useState, useEffect } from 'react';
+import clsx from 'clsx';
+import { Paperclip } from 'lucide-react';
+
+const formatSize = (bytes) => {
+    if (bytes < 1024) return `${bytes} B`;
+    if (bytes < 1024 * 1024) return `${(bytes / 1024).toFixed(1)} KB`;
+    return `${(bytes / (1024 * 1024)).toFixed(1)} MB`;
+};
+
+const Attachment = ({ id, isSent }) => {
+    const [info, setInfo] = useState(null);
+    const [missing, setMissing] = useState(false);
+    const [noThumbnail, setNoThumbnail] = useState(false);
+    const API_URL = import.meta.env.VITE_API_URL || '';
+    const url = `${API_URL}/api/attachments/${id}`;
+
+    useEffect(() => {
+        let cancelled = false;
+        fetch(`${url}/info`)
+            .then(response => {
+                if (!response.ok) throw new Error('Attachment not found');
+                return response.json();
+            })
+            .then(data => { if (!cancelled) setInfo(data); })
+            .catch(() => { if (!cancelled) setMissing(true); });
+        return () => { cancelled = true; };
+    }, [url]);
+
+    if (missing) {
+        return <p className="italic opacity-70 mb-1">Attachment unavailable</p>;
+    }
+    if (!info) {
+        return <p className="italic opacity-70 mb-1">Loading attachment...</p>;
+    }
+
+    // Only raster images are served inline; everything else is a download.
+    // Bubbles show the small thumbnail, falling back to the original while it is
+    // still being generated (or if the server can't make one).
+    if (info.inline) {
+        return (
+            <a href={url} target="_blank" rel="noopener noreferrer" className="block mb-2">
+                <img
+                    src={noThumbnail ? url : `${url}/thumbnail`}
+                    onError={() => setNoThumbnail(true)}
+                    alt={info.filename}
+                    className="max-h-64 rounded-lg"
+                />
+            </a>
+        );
+    }
+
+    return (
+        <a
+            href={url}
+            download={info.filename}
+            className={clsx(
+                "flex items-center gap-2 mb-2 underline",
+                isSent ? "text-white" : "text-blue-600"
+            )}
+        >
+            <Paperclip className="w-4 h-4 shrink-0" />
+            <span className="truncate">{info.filename}</span>
+            <span className="opacity-70 shrink-0">({formatSize(info.size)})</span>
+        </a>
+    );
+};
+
+export default Attachment;
@@ -1,12 +1,15 @@
 import React, { useState, useRef, useEffect } from 'react';
 import { useWebSocket } from '../../context/WebSocketContext';
 import MessageBubble from './MessageBubble';
-import { Send, MessageSquare } from 'lucide-react';
+import { Send, MessageSquare, Paperclip, X } from 'lucide-react';
 
 const ChatArea = ({ selectedContact }) => {
-    const { messages, sendMessage } = useWebSocket();
+    const { messages, sendMessage, uploadAttachment, unreadCounts, fetchOfflineMessages } = useWebSocket();
     const [inputText, setInputText] = useState('');
+    const [attachment, setAttachment] = useState(null); // Uploaded, waiting to be sent
+    const [uploading, setUploading] = useState(false);
     const messagesEndRef = useRef(null);
+    const fileInputRef = useRef(null);
 
     const currentMessages = selectedContact ? (messages[selectedContact] || []) : [];
 
@@ -18,12 +21,35 @@ const ChatArea = ({ selectedContact }) => {
         scrollToBottom();
     }, [currentMessages, selectedContact]);
 
+    // Lazily load a queued backlog (announced via offline digest) when the chat is opened
+    useEffect(() => {
+        if (selectedContact && unreadCounts[selectedContact] > 0) {
+            fetchOfflineMessages(selectedContact);
+        }
+    }, [selectedContact, unreadCounts]);
+
     const handleSend = (e) => {
         e.preventDefault();
-        if (!inputText.trim() || !selectedContact) return;
+        if ((!inputText.trim() && !attachment) || !selectedContact) return;
 
-        sendMessage(selectedContact, inputText);
+        sendMessage(selectedContact, inputText, attachment?.id);
         setInputText('');
+        setAttachment(null);
+    };
+
+    const handleFileChange = async (e) => {
+        const file = e.target.files[0];
+        e.target.value = ''; // Allow picking the same file again
+        if (!file) return;
+
+        setUploading(true);
+        try {
+            setAttachment(await uploadAttachment(file));
+        } catch (error) {
+            alert(error.message);
+        } finally {
+            setUploading(false);
+        }
     };
 
     if (!selectedContact) {
@@ -58,9 +84,12 @@ const ChatArea = ({ selectedContact }) => {
                         <MessageBubble
                             key={idx}
                             message={msg.message}
+                            attachment={msg.attachment}
                             isSent={msg.isSent}
                             sender={msg.sender}
                             timestamp={msg.timestamp}
+                            failed={msg.failed}
+                            error={msg.error}
                         />
                     ))
                 )}
@@ -69,7 +98,29 @@ const ChatArea = ({ selectedContact }) => {
 
             {/* Input */}
             <div className="p-4 bg-slate-800/40 border-t border-slate-700 backdrop-blur-md">
+                {attachment && (
+                    <div className="flex items-center gap-2 mb-2 text-sm text-slate-300">
+                        <Paperclip className="w-4 h-4" />
+                        <span className="truncate">{attachment.filename}</span>
+                        <button
+                            type="button"
+                            onClick={() => setAttachment(null)}
+                            className="text-slate-500 hover:text-slate-300"
+                        >
+                            <X className="w-4 h-4" />
+                        </button>
+                    </div>
+                )}
                 <form onSubmit={handleSend} className="flex gap-2">
+                    <input type="file" ref={fileInputRef} onChange={handleFileChange} className="hidden" />
+                    <button
+                        type="button"
+                        onClick={() => fileInputRef.current?.click()}
+                        disabled={uploading}
+                        className="bg-slate-900/60 border border-slate-600 text-slate-300 p-3 rounded-xl hover:text-white active:scale-95 disabled:opacity-50 disabled:cursor-not-allowed transition-all"
+                    >
+                        <Paperclip className="w-5 h-5" />
+                    </button>
                     <input
                         type="text"
                         placeholder="Type your message..."
@@ -79,7 +130,7 @@ const ChatArea = ({ selectedContact }) => {
                     />
                     <button
                         type="submit"
-                        disabled={!inputText.trim()}
+                        disabled={(!inputText.trim() && !attachment) || uploading}
                         className="bg-gradient-to-r from-purple-600 to-blue-600 text-white p-3 rounded-xl hover:opacity-90 active:scale-95 disabled:opacity-50 disabled:cursor-not-allowed transition-all shadow-lg shadow-purple-500/20"
                     >
                         <Send className="w-5 h-5" />
@@ -1,7 +1,8 @@
 import React from 'react';
 import clsx from 'clsx';
+import Attachment from './Attachment';
 
-const MessageBubble = ({ message, isSent, sender, timestamp }) => {
+const MessageBubble = ({ message, attachment, isSent, sender, timestamp, failed, error }) => {
     const timeObj = new Date(timestamp);
     const timeStr = timeObj.toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
 
@@ -15,7 +16,10 @@ const MessageBubble = ({ message, isSent, sender, timestamp }) => {
                     ? "bg-gradient-to-r from-blue-600 to-purple-600 text-white rounded-br-none"
                     : "bg-white text-slate-800 rounded-bl-none"
             )}>
-                <p className="mr-8 pb-2">{message}</p>
+                {attachment && <Attachment id={attachment} isSent={isSent} />}
+                {message
+                    ? <p className="mr-8 pb-2">{message}</p>
+                    : <div className="pb-3" /> /* Room for the timestamp under an attachment */}
                 <div className={clsx(
                     "absolute bottom-1 right-2 text-[10px] font-medium opacity-70",
                     isSent ? "text-blue-100" : "text-slate-500"
@@ -23,6 +27,11 @@ const MessageBubble = ({ message, isSent, sender, timestamp }) => {
                     {timeStr}
                 </div>
             </div>
+            {failed && (
+                <span className="text-xs text-red-400 mt-1 mr-1">
+                    Not delivered{error ? `: ${error}` : ''}
+                </span>
+            )}
         </div>
     );
 };
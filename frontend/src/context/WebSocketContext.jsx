@@ -17,6 +17,7 @@ export const WebSocketProvider = ({ children }) => {
     const reconnectTimeoutRef = useRef(null);
     const pingIntervalRef = useRef(null);
     const shouldReconnectRef = useRef(true); // Track if we should auto-reconnect
+    const reconnectDelayRef = useRef(null); // Server-suggested reconnect delay (ms)
 
 
     // Load message history from server on mount
@@ -50,7 +51,7 @@ export const WebSocketProvider = ({ children }) => {
                     const messagesMap = {};
 
                     data.messages.forEach(msg => {
-                        const { sender, recipient, message, timestamp } = msg;
+                        const { sender, recipient, message, timestamp, attachment } = msg;
                         const isSent = sender === user.username;
                         const contact = isSent ? recipient : sender;
 
@@ -66,6 +67,7 @@ export const WebSocketProvider = ({ children }) => {
                         messagesMap[contact].push({
                             sender: isSent ? 'You' : sender,
                             message: message,
+                            attachment: attachment,
                             isSent: isSent,
                             timestamp: finalTimestamp
                         });
@@ -146,6 +148,20 @@ export const WebSocketProvider = ({ children }) => {
                         shouldReconnectRef.current = false;
                         alert(data.message || 'You have been logged out because you logged in from another device');
                         logout(); // Clear session and return to login
+                    } else if (data.type === 'offline_digest') {
+                        // Large backlog - messages are fetched per contact when the chat is opened
+                        const counts = {};
+                        data.senders.forEach(s => { counts[s.from] = s.count; });
+                        setUnreadCounts(prev => ({ ...prev, ...counts }));
+                        setContacts(prev => [...new Set([...prev, ...Object.keys(counts)])]);
+                        console.log('Offline digest:', data.message);
+                    } else if (data.type === 'error') {
+                        // Server refused a message (e.g. recipient's offline queue is full)
+                        markMessageFailed(data.to, data.id, data.error);
+                        console.warn('Message rejected:', data.error);
+                    } else if (data.type === 'reconnect') {
+                        // Server is restarting or busy - come back after its (jittered) delay
+                        reconnectDelayRef.current = (data.after || 3) * 1000;
                     } else if (data.type === 'friend_request') {
                         // Incoming friend request
                         setPendingRequests(prev => [...prev, { from: data.from, timestamp: new Date().toISOString() }]);
@@ -179,12 +195,14 @@ export const WebSocketProvider = ({ children }) => {
                 }
 
                 // Auto-reconnect only if still logged in
+                const delay = reconnectDelayRef.current || 3000;
+                reconnectDelayRef.current = null;
                 if (reconnectTimeoutRef.current) clearTimeout(reconnectTimeoutRef.current);
                 reconnectTimeoutRef.current = setTimeout(() => {
                     if (shouldReconnectRef.current) {
                         connect(); // Reconnect if flag is still true
                     }
-                }, 3000);
+                }, delay);
             };
 
             ws.onerror = (err) => {
@@ -217,7 +235,7 @@ export const WebSocketProvider = ({ children }) => {
     }, [user, token]);
 
     const handleIncomingMessage = (data) => {
-        const { from, message, timestamp } = data;
+        const { from, message, timestamp, attachment } = data;
 
         // Auto-add contact
         setContacts(prev => {
@@ -234,6 +252,7 @@ export const WebSocketProvider = ({ children }) => {
         const newMsg = {
             sender: from,
             message: message,
+            attachment: attachment,
             isSent: false,
             timestamp: finalTimestamp
         };
@@ -246,18 +265,93 @@ export const WebSocketProvider = ({ children }) => {
         // Increment badge if needed (handled by UI using unreadCounts, simplified here)
     };
 
-    const sendMessage = (recipient, content) => {
+    const markMessageFailed = (recipient, id, error) => {
+        setMessages(prev => {
+            const list = prev[recipient];
+            if (!list) return prev;
+            // Fall back to the latest sent message if the server didn't echo an id
+            let index = list.findIndex(m => id && m.id === id);
+            if (index === -1) {
+                for (let i = list.length - 1; i >= 0; i--) {
+                    if (list[i].isSent && !list[i].failed) { index = i; break; }
+                }
+            }
+            if (index === -1) return prev;
+            const updated = [...list];
+            updated[index] = { ...updated[index], failed: true, error };
+            return { ...prev, [recipient]: updated };
+        });
+    };
+
+    // Pull queued messages from one contact (after an offline digest)
+    const fetchOfflineMessages = async (contact) => {
+        const API_URL = import.meta.env.VITE_API_URL || '';
+        try {
+            let remaining = true;
+            while (remaining) {
+                const response = await fetch(`${API_URL}/api/offline/${user.username}?token=${token}&sender=${encodeURIComponent(contact)}`);
+                if (!response.ok) throw new Error('Failed to fetch offline messages');
+                const data = await response.json();
+
+                // History loaded on mount may already contain these
+                setMessages(prev => {
+                    const existing = prev[contact] || [];
+                    const key = m => `${m.timestamp}|${m.message}|${m.attachment || ''}`;
+                    const seen = new Set(existing.map(key));
+                    const fresh = data.messages
+                        .map(msg => ({
+                            sender: msg.from,
+                            message: msg.message,
+                            attachment: msg.attachment,
+                            isSent: false,
+                            timestamp: msg.timestamp.replace(' ', 'T') + 'Z'
+                        }))
+                        .filter(m => !seen.has(key(m)));
+                    return { ...prev, [contact]: [...existing, ...fresh] };
+                });
+                remaining = data.messages.length > 0 && data.remaining > 0;
+            }
+            setUnreadCounts(prev => ({ ...prev, [contact]: 0 }));
+        } catch (e) {
+            console.error('Fetch offline messages error:', e);
+        }
+    };
+
+    // Upload a file; returns its metadata ({ id, filename, content_type, size })
+    const uploadAttachment = async (file) => {
+        const API_URL = import.meta.env.VITE_API_URL || '';
+        const response = await fetch(
+            `${API_URL}/api/attachments?token=${token}&filename=${encodeURIComponent(file.name)}`, {
+            method: 'POST',
+            headers: { 'Content-Type': file.type || 'application/octet-stream' },
+            body: file
+        });
+        if (!response.ok) {
+            const data = await response.json().catch(() => ({}));
+            throw new Error(data.detail || 'Upload failed');
+        }
+        const data = await response.json();
+        return data.attachment;
+    };
+
+    const sendMessage = (recipient, content, attachmentId = null) => {
         if (!socket || socket.readyState !== WebSocket.OPEN) {
             console.error("Socket not connected");
             return;
         }
 
-        socket.send(JSON.stringify({ to: recipient, message: content }));
+        // Echoed back in error frames so the right bubble can be marked failed
+        const id = `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+        const frame = { to: recipient, message: content, id };
+        if (attachmentId) frame.attachment = attachmentId;
+        socket.send(JSON.stringify(frame));
 
         const timestamp = new Date().toISOString();
         const newMsg = {
+            id,
             sender: 'You',
             message: content,
+            attachment: attachmentId,
             isSent: true,
             timestamp: timestamp
         };
@@ -382,7 +476,10 @@ export const WebSocketProvider = ({ children }) => {
         <WebSocketContext.Provider value={{
             isConnected,
             sendMessage,
+            uploadAttachment,
             messages,
+            unreadCounts,
+            fetchOfflineMessages,
             contacts,
             onlineUsers,
             pendingRequests,
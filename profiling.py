@@ -0,0 +1,218 @@
+"""Opt-in profiling: slow-operation log, SQLite query plans, loop lag, cProfile.
+
+Enable with CHAT_PROFILING=1 (threshold via CHAT_SLOW_MS, default 100).
+When disabled, `timed()` returns a shared no-op context manager and the
+SQLite engine uses the plain sqlite3.Connection, so the cost is close to
+nothing.
+"""
+from collections import deque
+from contextlib import nullcontext
+from typing import Optional
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sqlite3
+import sys
+import tempfile
+import time
+
+# Frames from these files are skipped when looking for the call site
+_INTERNAL_FILES = {os.path.abspath(__file__), os.path.abspath(sqlite3.__file__)}
+_NULL = nullcontext()
+
+
+def call_site(skip_files=()) -> str:
+    """First caller outside the profiling/storage plumbing, as file:line in function."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename not in _INTERNAL_FILES and filename not in skip_files:
+            return f"{os.path.basename(filename)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "?"
+
+
+class _Timer:
+    __slots__ = ("profiler", "label", "detail", "site", "start")
+
+    def __init__(self, profiler: "Profiler", label: str, detail, site: str):
+        self.profiler = profiler
+        self.label = label
+        self.detail = detail
+        self.site = site
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        if duration >= self.profiler.threshold:
+            label = self.label if self.detail is None else f"{self.label} ({self.detail})"
+            self.profiler.record("await", label, duration, self.site)
+        return False
+
+
+class Profiler:
+    def __init__(self, enabled: bool, threshold_ms: float, lag_interval: float = 0.5):
+        self.enabled = enabled
+        self.threshold = threshold_ms / 1000
+        self.lag_interval = lag_interval
+        self.slow_ops = deque(maxlen=200)
+        self.lag_samples = deque(maxlen=600)  # ~5 minutes at the default interval
+        self._lag_task: Optional[asyncio.Task] = None
+        self._cprofile_running = False
+
+    def timed(self, label: str, detail=None):
+        """Context manager that logs the wrapped block (usually an await) if it is slow."""
+        if not self.enabled:
+            return _NULL
+        return _Timer(self, label, detail, call_site())
+
+    def record(self, kind: str, description: str, duration: float, site: str, plan=None):
+        entry = {
+            "kind": kind,
+            "operation": description,
+            "ms": round(duration * 1000, 1),
+            "call_site": site,
+            "at": time.time(),
+        }
+        if plan:
+            entry["query_plan"] = plan
+        self.slow_ops.append(entry)
+        print(f"[slow {kind}] {entry['ms']}ms {' '.join(description.split())[:200]} at {site}")
+        if plan:
+            for line in plan:
+                print(f"    plan: {line}")
+
+    # --- Event loop ---
+
+    def start(self):
+        """Hook the running loop: log slow callbacks and sample loop lag."""
+        if not self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        # asyncio's debug mode logs every callback/step that blocks longer than this,
+        # with the task's creation site (catches bcrypt and other sync work)
+        loop.set_debug(True)
+        loop.slow_callback_duration = self.threshold
+        self._lag_task = asyncio.create_task(self._sample_lag())
+
+    def stop(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+
+    async def _sample_lag(self):
+        while True:
+            expected = time.perf_counter() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, time.perf_counter() - expected)
+            self.lag_samples.append(lag)
+            if lag >= self.threshold:
+                self.record("loop-lag", "event loop lag", lag, "event loop")
+
+    def stats(self) -> dict:
+        lags = sorted(self.lag_samples)
+        lag_stats = {}
+        if lags:
+            lag_stats = {
+                "samples": len(lags),
+                "avg_ms": round(sum(lags) / len(lags) * 1000, 2),
+                "p99_ms": round(lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000, 2),
+                "max_ms": round(lags[-1] * 1000, 2),
+            }
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "loop_lag": lag_stats,
+            "slow_operations": list(self.slow_ops),
+        }
+
+    # --- cProfile ---
+
+    async def run_cprofile(self, seconds: float) -> cProfile.Profile:
+        """Profile the event loop thread for `seconds` while it keeps serving."""
+        if self._cprofile_running:
+            raise RuntimeError("A profile is already running")
+        self._cprofile_running = True
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+            self._cprofile_running = False
+        return profile
+
+    # --- SQLite ---
+
+    def connection_factory(self):
+        """sqlite3.Connection subclass that times statements (only used when enabled)."""
+        profiler = self
+
+        class ProfilingCursor(sqlite3.Cursor):
+            def execute(self, sql, parameters=()):
+                start = time.perf_counter()
+                result = super().execute(sql, parameters)
+                profiler._check_query(self.connection, sql, parameters, time.perf_counter() - start)
+                return result
+
+            def executemany(self, sql, seq_of_parameters):
+                seq_of_parameters = list(seq_of_parameters)
+                start = time.perf_counter()
+                result = super().executemany(sql, seq_of_parameters)
+                first = seq_of_parameters[0] if seq_of_parameters else ()
+                profiler._check_query(self.connection, sql, first, time.perf_counter() - start)
+                return result
+
+        class ProfilingConnection(sqlite3.Connection):
+            def cursor(self, factory=ProfilingCursor):
+                return super().cursor(factory)
+
+            def execute(self, sql, parameters=()):
+                return self.cursor().execute(sql, parameters)
+
+            def executemany(self, sql, seq_of_parameters):
+                return self.cursor().executemany(sql, seq_of_parameters)
+
+        return ProfilingConnection
+
+    def _check_query(self, connection, sql: str, parameters, duration: float):
+        if duration < self.threshold:
+            return
+        plan = None
+        if not sql.lstrip().upper().startswith(("CREATE", "ALTER", "EXPLAIN")):
+            try:
+                # Plain cursor so the EXPLAIN itself isn't profiled
+                rows = sqlite3.Cursor(connection).execute("EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+                plan = [row[-1] for row in rows]
+            except sqlite3.Error:
+                pass
+        storage_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage.py")
+        self.record("db", sql, duration, call_site({storage_file}), plan)
+
+
+def profile_to_bytes(profile: cProfile.Profile) -> bytes:
+    """Serialize a profile in pstats format (loadable by pstats, snakeviz, etc.)."""
+    fd, path = tempfile.mkstemp(suffix=".prof")
+    os.close(fd)
+    try:
+        profile.dump_stats(path)
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+def profile_to_text(profile: cProfile.Profile, limit: int = 50) -> str:
+    out = io.StringIO()
+    pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+
+profiler = Profiler(
+    enabled=os.environ.get("CHAT_PROFILING") == "1",
+    threshold_ms=float(os.environ.get("CHAT_SLOW_MS", "100")),
+)
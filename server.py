@@ -1,10 +1,16 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
+from fastapi.responses import FileResponse, Response
 from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.staticfiles import NotModifiedResponse
+from mimetypes import guess_type
 from pydantic import BaseModel
 from typing import Dict, List, Optional
-import json
 import sqlite3
+from storage import Storage, SQLiteStorage
+from attachments import AttachmentStore, AttachmentTooLarge, is_raster_image
+from profiling import profiler, profile_to_bytes, profile_to_text
+import json
 import asyncio
 import os
 import bcrypt
@@ -12,8 +18,26 @@ import jwt
 from datetime import datetime, timedelta
 import random
 import string
+import time
+import re
+import gzip
+import hashlib
+import secrets
+from contextlib import asynccontextmanager
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    profiler.start()
+    sweeper = asyncio.create_task(sweep_expired_messages())
+    yield
+    sweeper.cancel()
+    profiler.stop()
+    # No drain here: by the time lifespan shutdown runs, uvicorn has already
+    # closed every WebSocket with 1012. Draining (reconnect frame + jittered
+    # delay) only happens when started via `python server.py`, see ChatServer.
+    attachment_store.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -26,75 +50,190 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Serve static files
+# --- Static Files ---
+STATIC_DIR = "static"
+INDEX_FILE = os.path.join(STATIC_DIR, "index.html")
+
+# Vite emits content-hashed names like index-B3x9_aQz.js; those never change
+HASHED_ASSET_RE = re.compile(r"-[A-Za-z0-9_-]{8}\.[a-z0-9]+$")
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+# Preferred first; extension of the precompressed sibling file
+PRECOMPRESSED = [("br", ".br"), ("gzip", ".gz")]
+COMPRESSIBLE_EXTENSIONS = {".js", ".css", ".html", ".svg", ".json", ".map", ".txt"}
+
+def accepted_encodings(header: str) -> set:
+    """Parse an Accept-Encoding header into the set of acceptable codings."""
+    accepted = set()
+    for part in header.split(","):
+        coding, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        q = 1.0
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                pass
+        if q > 0 and coding.strip():
+            accepted.add(coding.strip().lower())
+    return accepted
+
+def precompress_assets(directory: str):
+    """Write .gz (and .br, if brotli is installed) next to built assets that lack them
+    or whose source was rebuilt since. Failures (e.g. read-only static/) are logged
+    and skipped; those files are just served uncompressed."""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    compressors = [(".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli:
+        compressors.append((".br", brotli.compress))
+
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.splitext(name)[1] not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            try:
+                source_mtime = os.stat(path).st_mtime
+                stale = [(ext, compress) for ext, compress in compressors
+                         if not os.path.exists(path + ext) or os.stat(path + ext).st_mtime < source_mtime]
+                if not stale:
+                    continue
+                with open(path, "rb") as f:
+                    data = f.read()
+                for ext, compress in stale:
+                    # Write then rename so a half-written file is never served
+                    tmp = path + ext + ".tmp"
+                    with open(tmp, "wb") as f:
+                        f.write(compress(data))
+                    os.replace(tmp, path + ext)
+            except OSError as e:
+                print(f"Skipping precompression of {path}: {e}")
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves precompressed .br/.gz siblings and caches hashed assets forever."""
+
+    async def get_response(self, path, scope):
+        # Siblings are only reachable through Accept-Encoding negotiation; served
+        # directly they'd be compressed bytes with a JS/CSS type and no Content-Encoding
+        if path.endswith(tuple(ext for _, ext in PRECOMPRESSED)):
+            raise HTTPException(status_code=404, detail="Not Found")
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        headers = {"Vary": "Accept-Encoding"}
+        if HASHED_ASSET_RE.search(str(full_path)):
+            headers["Cache-Control"] = IMMUTABLE_CACHE
+        else:
+            headers["Cache-Control"] = "no-cache"
+
+        path = str(full_path)
+        media_type = guess_type(path)[0] or "text/plain"
+        accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+        for encoding, ext in PRECOMPRESSED:
+            if encoding not in accepted:
+                continue
+            try:
+                sibling = os.stat(path + ext)
+            except OSError:
+                continue
+            # Ignore a copy older than its source (rebuilt and not recompressed yet)
+            if sibling.st_mtime >= stat_result.st_mtime:
+                path += ext
+                stat_result = sibling
+                headers["Content-Encoding"] = encoding
+                break
+
+        # FileResponse derives the ETag from the served file, so each encoding gets its own
+        response = FileResponse(path, status_code=status_code, stat_result=stat_result,
+                                media_type=media_type, headers=headers)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+class IndexCache:
+    """index.html (plus a gzip copy) held in memory, reloaded only when the file changes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = None
+        self.body = b""
+        self.gzipped = b""
+        self.etag = ""
+
+    def load(self):
+        mtime = os.stat(self.path).st_mtime
+        if mtime != self.mtime:
+            with open(self.path, "rb") as f:
+                self.body = f.read()
+            self.gzipped = gzip.compress(self.body, mtime=0)
+            self.etag = '"' + hashlib.md5(self.body).hexdigest() + '"'
+            self.mtime = mtime
+
+    def response(self, request: Request) -> Response:
+        try:
+            self.load()
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Frontend not built")
+
+        use_gzip = "gzip" in accepted_encodings(request.headers.get("accept-encoding", ""))
+        etag = self.etag[:-1] + '-gz"' if use_gzip else self.etag
+        # index.html must always be revalidated so new asset hashes are picked up
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+
+        if_none_match = request.headers.get("if-none-match", "")
+        if if_none_match.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        if use_gzip:
+            headers["Content-Encoding"] = "gzip"
+            return Response(self.gzipped, media_type="text/html", headers=headers)
+        return Response(self.body, media_type="text/html", headers=headers)
+
+index_cache = IndexCache(INDEX_FILE)
+
 # Mount assets (JS/CSS) only if they exist (produced by build)
-if os.path.exists("static/assets"):
-    app.mount("/assets", StaticFiles(directory="static/assets"), name="assets")
+if os.path.exists(os.path.join(STATIC_DIR, "assets")):
+    precompress_assets(os.path.join(STATIC_DIR, "assets"))
+    app.mount("/assets", PrecompressedStaticFiles(directory=os.path.join(STATIC_DIR, "assets")), name="assets")
 
 # JWT Configuration
 SECRET_KEY = "your-secret-key-change-in-production"  # Change this in production!
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 
+# Connection admission / drain configuration
+MAX_CONNECTS_PER_SECOND = 200  # Handshakes admitted per second (token bucket rate)
+CONNECT_BURST = 50  # Handshakes admitted immediately before queueing kicks in
+MAX_PENDING_HANDSHAKES = 5000  # Queued handshakes beyond this are told to retry later
+RECONNECT_BASE_SECONDS = 15  # Clients are told to reconnect after base +/- jitter (5-25s)
+RECONNECT_JITTER_SECONDS = 10  # Keep <= base so the window never goes negative
+DRAIN_TIMEOUT_SECONDS = 10  # Max time spent flushing sockets on shutdown
+
+# Offline queue limits
+OFFLINE_QUEUE_MAX = 1000  # Undelivered messages kept per recipient
+OFFLINE_QUEUE_POLICY = "drop_oldest"  # "drop_oldest" or "reject" once the queue is full
+OFFLINE_MESSAGE_TTL_DAYS = 30  # Undelivered messages older than this are deleted
+OFFLINE_DIGEST_THRESHOLD = 50  # Bigger backlogs get a digest frame instead of every message
+OFFLINE_PAGE_SIZE = 100  # Max messages per /api/offline fetch
+OFFLINE_SWEEP_INTERVAL_SECONDS = 60 * 60
+
 @app.get("/")
-async def get_index():
-    return FileResponse("static/index.html")
+async def get_index(request: Request):
+    return index_cache.response(request)
 
-# SPA Catch-all (Must be last) - Handled separately or use exceptions?
-# Usually, we verify if file exists, else return index.html for client-side routing.
-# But for simplicity, we can just rely on the fallback below.
+# SPA Catch-all is registered at the bottom of the file (it must be the last route).
 
 # --- Database ---
 DB_NAME = "chat.db"
 
-def init_db():
-    """Initialize the database with users and messages tables."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            username TEXT PRIMARY KEY,
-            password_hash TEXT NOT NULL,
-            recovery_key_hash TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''') 
-    
-    # Check if recovery_key_hash column exists (for migration)
-    try:
-        cursor.execute("SELECT recovery_key_hash FROM users LIMIT 1")
-    except sqlite3.OperationalError:
-        cursor.execute("ALTER TABLE users ADD COLUMN recovery_key_hash TEXT")
-        print("Migrated DB: Added recovery_key_hash column")
-    
-    # Messages table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender TEXT,
-            recipient TEXT,
-            content TEXT,
-            is_delivered BOOLEAN,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Friend requests table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS friend_requests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender TEXT NOT NULL,
-            recipient TEXT NOT NULL,
-            status TEXT DEFAULT 'pending',
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(sender, recipient)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+# All persistence goes through this; swap in MemoryStorage() for tests/benchmarks
+storage: Storage = SQLiteStorage(
+    DB_NAME,
+    connection_factory=profiler.connection_factory() if profiler.enabled else sqlite3.Connection
+)
 
 # --- User Authentication ---
 
@@ -159,24 +298,17 @@ async def register(user: UserRegister):
     if user.password != user.confirm_password:
         raise HTTPException(status_code=400, detail="Passwords do not match")
     
-    # Check if user already exists
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT username FROM users WHERE username = ?", (user.username,))
-    if cursor.fetchone():
-        conn.close()
+    # Check if user already exists (before paying for bcrypt)
+    if storage.user_exists(user.username):
         raise HTTPException(status_code=400, detail="Username already exists")
     
-    # Create user
     # Create user with recovery key
     recovery_key = generate_recovery_key()
     recovery_key_hash = hash_password(recovery_key)
     
     password_hash = hash_password(user.password)
-    cursor.execute("INSERT INTO users (username, password_hash, recovery_key_hash) VALUES (?, ?, ?)", 
-                   (user.username, password_hash, recovery_key_hash))
-    conn.commit()
-    conn.close()
+    if not storage.create_user(user.username, password_hash, recovery_key_hash):
+        raise HTTPException(status_code=400, detail="Username already exists")
     
     # Generate token
     token = create_access_token(user.username)
@@ -205,15 +337,10 @@ async def get_recovery_key(data: dict, token: str = None):
     if not token_user or token_user != username:
         raise HTTPException(status_code=403, detail="Invalid token")
 
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
     new_key = generate_recovery_key()
     key_hash = hash_password(new_key)
     
-    cursor.execute("UPDATE users SET recovery_key_hash = ? WHERE username = ?", (key_hash, username))
-    conn.commit()
-    conn.close()
+    storage.set_recovery_key_hash(username, key_hash)
     
     return {"success": True, "recovery_key": new_key}
 
@@ -226,43 +353,28 @@ async def reset_password(data: PasswordReset):
     if len(data.new_password) < 6:
         raise HTTPException(status_code=400, detail="Password must be at least 6 characters")
 
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT recovery_key_hash FROM users WHERE username = ?", (data.username,))
-    row = cursor.fetchone()
+    stored_hash = storage.get_recovery_key_hash(data.username)
     
-    if not row or not row[0]:
-        conn.close()
+    if not stored_hash:
         raise HTTPException(status_code=404, detail="User not found or no recovery key set")
-        
-    stored_hash = row[0]
     
     if not verify_password(data.recovery_key, stored_hash):
-        conn.close()
         raise HTTPException(status_code=400, detail="Invalid recovery key")
         
     new_hash = hash_password(data.new_password)
     
-    cursor.execute("UPDATE users SET password_hash = ? WHERE username = ?", (new_hash, data.username))
-    conn.commit()
-    conn.close()
+    storage.set_password_hash(data.username, new_hash)
     
     return {"success": True, "message": "Password reset successfully"}
 
 @app.post("/api/login")
 async def login(user: UserLogin):
     """Login a user."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT password_hash FROM users WHERE username = ?", (user.username,))
-    result = cursor.fetchone()
-    conn.close()
+    password_hash = storage.get_password_hash(user.username)
     
-    if not result:
+    if not password_hash:
         raise HTTPException(status_code=401, detail="Invalid username or password")
     
-    password_hash = result[0]
     if not verify_password(user.password, password_hash):
         raise HTTPException(status_code=401, detail="Invalid username or password")
     
@@ -279,30 +391,22 @@ async def login(user: UserLogin):
 @app.get("/api/history/{username}")
 async def get_history(username: str):
     """Get all message history for a user (sent and received)."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
     # Get all messages where user is sender or recipient
-    cursor.execute('''
-        SELECT sender, recipient, content, timestamp, is_delivered 
-        FROM messages
-        WHERE sender = ? OR recipient = ?
-        ORDER BY timestamp ASC
-    ''', (username, username))
-    
-    rows = cursor.fetchall()
-    conn.close()
+    rows = storage.get_history(username)
     
     messages = []
     for row in rows:
-        sender, recipient, content, timestamp, is_delivered = row
-        messages.append({
+        sender, recipient, content, timestamp, is_delivered, attachment_id = row
+        message = {
             "sender": sender,
             "recipient": recipient,
             "message": content,
             "timestamp": timestamp,
             "is_delivered": is_delivered
-        })
+        }
+        if attachment_id:
+            message["attachment"] = attachment_id
+        messages.append(message)
     
     return {"messages": messages}
 
@@ -312,20 +416,8 @@ async def search_users(q: str = ""):
     if not q or len(q) < 1:
         return {"users": []}
     
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
     # Search for usernames containing the query (case-insensitive)
-    cursor.execute('''
-        SELECT username FROM users
-        WHERE LOWER(username) LIKE LOWER(?)
-        LIMIT 10
-    ''', (f'%{q}%',))
-    
-    rows = cursor.fetchall()
-    conn.close()
-    
-    users = [row[0] for row in rows]
+    users = storage.search_users(q, limit=10)
     return {"users": users}
 
 @app.post("/api/friend-request/send")
@@ -340,44 +432,23 @@ async def send_friend_request(data: dict):
     if sender == recipient:
         raise HTTPException(status_code=400, detail="Cannot send request to yourself")
     
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
     # Check if recipient exists
-    cursor.execute("SELECT username FROM users WHERE username = ?", (recipient,))
-    if not cursor.fetchone():
-        conn.close()
+    if not storage.user_exists(recipient):
         raise HTTPException(status_code=404, detail="User not found")
     
     # Check if already friends or request exists
-    cursor.execute('''
-        SELECT status FROM friend_requests 
-        WHERE (sender = ? AND recipient = ?) OR (sender = ? AND recipient = ?)
-    ''', (sender, recipient, recipient, sender))
-    
-    existing = cursor.fetchone()
-    if existing:
-        conn.close()
-        if existing[0] == 'accepted':
-            raise HTTPException(status_code=400, detail="Already friends")
-        elif existing[0] == 'pending':
-            raise HTTPException(status_code=400, detail="Request already sent")
-        elif existing[0] == 'blocked':
-            raise HTTPException(status_code=403, detail="Cannot send request")
+    existing = storage.get_friendship_status(sender, recipient)
+    if existing == 'accepted':
+        raise HTTPException(status_code=400, detail="Already friends")
+    elif existing == 'pending':
+        raise HTTPException(status_code=400, detail="Request already sent")
+    elif existing == 'blocked':
+        raise HTTPException(status_code=403, detail="Cannot send request")
     
     # Create friend request
-    try:
-        cursor.execute('''
-            INSERT INTO friend_requests (sender, recipient, status)
-            VALUES (?, ?, 'pending')
-        ''', (sender, recipient))
-        conn.commit()
-    except sqlite3.IntegrityError:
-        conn.close()
+    if not storage.create_friend_request(sender, recipient):
         raise HTTPException(status_code=400, detail="Request already exists")
     
-    conn.close()
-    
     # Notify recipient via WebSocket
     await manager.send_notification(recipient, {
         "type": "friend_request",
@@ -400,30 +471,13 @@ async def respond_friend_request(data: dict):
     if action not in ['accept', 'reject', 'block']:
         raise HTTPException(status_code=400, detail="Invalid action")
     
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
     # Update request status
     if action == 'accept':
-        cursor.execute('''
-            UPDATE friend_requests 
-            SET status = 'accepted'
-            WHERE sender = ? AND recipient = ? AND status = 'pending'
-        ''', (sender, recipient))
+        storage.accept_friend_request(sender, recipient)
     elif action == 'reject':
-        cursor.execute('''
-            DELETE FROM friend_requests
-            WHERE sender = ? AND recipient = ? AND status = 'pending'
-        ''', (sender, recipient))
+        storage.reject_friend_request(sender, recipient)
     elif action == 'block':
-        cursor.execute('''
-            UPDATE friend_requests 
-            SET status = 'blocked'
-            WHERE sender = ? AND recipient = ?
-        ''', (sender, recipient))
-    
-    conn.commit()
-    conn.close()
+        storage.block_friend_request(sender, recipient)
     
     # Notify sender
     if action == 'accept':
@@ -438,33 +492,11 @@ async def respond_friend_request(data: dict):
 @app.get("/api/friend-request/list/{username}")
 async def list_friend_requests(username: str):
     """Get pending friend requests for a user."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
     # Get incoming pending requests
-    cursor.execute('''
-        SELECT sender, created_at FROM friend_requests
-        WHERE recipient = ? AND status = 'pending'
-        ORDER BY created_at DESC
-    ''', (username,))
-    
-    incoming = [{"from": row[0], "timestamp": row[1]} for row in cursor.fetchall()]
+    incoming = [{"from": row[0], "timestamp": row[1]} for row in storage.get_pending_requests(username)]
     
     # Get accepted friends
-    cursor.execute('''
-        SELECT sender, recipient FROM friend_requests
-        WHERE (sender = ? OR recipient = ?) AND status = 'accepted'
-    ''', (username, username))
-    
-    friends = []
-    for row in cursor.fetchall():
-        friend = row[1] if row[0] == username else row[0]
-        friends.append(friend)
-    
-    conn.close()
-    
-    # Remove duplicates
-    friends = list(set(friends))
+    friends = storage.get_friends(username)
     
     return {"pending": incoming, "friends": friends}
 
@@ -477,18 +509,8 @@ async def remove_friend(data: dict):
     if not username or not friend:
         raise HTTPException(status_code=400, detail="Missing required fields")
     
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
     # Delete the friendship
-    cursor.execute('''
-        DELETE FROM friend_requests
-        WHERE ((sender = ? AND recipient = ?) OR (sender = ? AND recipient = ?))
-        AND status = 'accepted'
-    ''', (username, friend, friend, username))
-    
-    conn.commit()
-    conn.close()
+    storage.remove_friend(username, friend)
     
     return {"success": True, "message": "Friend removed"}
 
@@ -501,17 +523,8 @@ async def block_friend(data: dict):
     if not username or not blocked_user:
         raise HTTPException(status_code=400, detail="Missing required fields")
     
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
     # Update or insert block status
-    cursor.execute('''
-        INSERT OR REPLACE INTO friend_requests (sender, recipient, status)
-        VALUES (?, ?, 'blocked')
-    ''', (username, blocked_user))
-    
-    conn.commit()
-    conn.close()
+    storage.block_user(username, blocked_user)
     
     return {"success": True, "message": "User blocked"}
 
@@ -524,83 +537,254 @@ async def unblock_friend(data: dict):
     if not username or not blocked_user:
         raise HTTPException(status_code=400, detail="Missing required fields")
     
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
     # Remove block
-    cursor.execute('''
-        DELETE FROM friend_requests
-        WHERE sender = ? AND recipient = ? AND status = 'blocked'
-    ''', (username, blocked_user))
-    
-    conn.commit()
-    conn.close()
+    storage.unblock_user(username, blocked_user)
     
     return {"success": True, "message": "User unblocked"}
 
 @app.get("/api/friend/blocked/{username}")
 async def get_blocked_users(username: str):
     """Get list of blocked users."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+    blocked = storage.get_blocked_users(username)
     
-    cursor.execute('''
-        SELECT recipient FROM friend_requests
-        WHERE sender = ? AND status = 'blocked'
-    ''', (username,))
+    return {"blocked": blocked}
+
+
+# --- Attachments ---
+UPLOAD_DIR = "uploads"
+MAX_ATTACHMENT_BYTES = 25 * 1024 * 1024  # 25 MB
+ATTACHMENT_HEADERS = {
+    "Cache-Control": "private, max-age=31536000, immutable",
+    "X-Content-Type-Options": "nosniff",
+    "Content-Security-Policy": "sandbox",
+}
+
+attachment_store = AttachmentStore(UPLOAD_DIR)
+
+@app.post("/api/attachments")
+async def upload_attachment(request: Request, token: str = None, filename: str = "file"):
+    """Upload a file as the raw request body; returns an id to reference from messages."""
+    uploader = verify_token(token) if token else None
+    if not uploader:
+        raise HTTPException(status_code=401, detail="Authentication required")
     
-    blocked = [row[0] for row in cursor.fetchall()]
-    conn.close()
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_ATTACHMENT_BYTES:
+        raise HTTPException(status_code=413, detail="Attachment too large")
     
-    return {"blocked": blocked}
+    content_type = request.headers.get("content-type") or guess_type(filename)[0] or "application/octet-stream"
+    filename = os.path.basename(filename) or "file"
+    
+    # Stream to disk chunk by chunk (never holds the whole file in memory)
+    try:
+        sha256, size = await attachment_store.save_stream(request.stream(), MAX_ATTACHMENT_BYTES)
+    except AttachmentTooLarge:
+        raise HTTPException(status_code=413, detail="Attachment too large")
+    
+    attachment_id = secrets.token_urlsafe(16)
+    storage.save_attachment(attachment_id, sha256, filename, content_type, size, uploader)
+    attachment_store.schedule_thumbnail(sha256, content_type)
+    
+    return {
+        "success": True,
+        "attachment": {"id": attachment_id, "filename": filename, "content_type": content_type, "size": size}
+    }
+
+@app.get("/api/attachments/{attachment_id}")
+async def download_attachment(attachment_id: str):
+    """Download an attachment (supports Range requests)."""
+    attachment = storage.get_attachment(attachment_id)
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    
+    sha256, filename, content_type, size, uploader = attachment
+    inline = is_raster_image(content_type)
+    media_type = content_type.split(";")[0].strip().lower()
+    # Content-addressed: the bytes behind an id never change
+    return FileResponse(
+        attachment_store.object_path(sha256),
+        media_type=media_type if inline else "application/octet-stream",
+        filename=filename,
+        content_disposition_type="inline" if inline else "attachment",
+        headers=ATTACHMENT_HEADERS
+    )
+
+@app.get("/api/attachments/{attachment_id}/info")
+async def get_attachment_info(attachment_id: str):
+    """Metadata the client needs to render an attachment (image preview vs. file link)."""
+    attachment = storage.get_attachment(attachment_id)
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    
+    sha256, filename, content_type, size, uploader = attachment
+    return {
+        "id": attachment_id,
+        "filename": filename,
+        "size": size,
+        "inline": is_raster_image(content_type)
+    }
+
+@app.get("/api/attachments/{attachment_id}/thumbnail")
+async def download_thumbnail(attachment_id: str):
+    """Get the JPEG thumbnail of an image attachment, once generated."""
+    attachment = storage.get_attachment(attachment_id)
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    
+    path = attachment_store.thumbnail_path(attachment[0])
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Thumbnail not available")
+    return FileResponse(path, media_type="image/jpeg", headers=ATTACHMENT_HEADERS)
+
+
+# --- Admin / Profiling ---
+# Only available with CHAT_PROFILING=1 and CHAT_ADMIN_TOKEN set
+ADMIN_TOKEN = os.environ.get("CHAT_ADMIN_TOKEN")
+
+def require_admin(token: Optional[str]):
+    if not profiler.enabled or not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not token or not secrets.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/api/admin/slow")
+async def get_slow_operations(token: str = None):
+    """Recent slow awaits/queries (with call sites and query plans) and event-loop lag."""
+    require_admin(token)
+    return profiler.stats()
+
+@app.get("/api/admin/profile")
+async def get_profile(token: str = None, seconds: float = 10, format: str = "pstats"):
+    """cProfile the event loop for a few seconds; returns a .prof file or a text report."""
+    require_admin(token)
+    if not 0 < seconds <= 120:
+        raise HTTPException(status_code=400, detail="seconds must be between 0 and 120")
+    try:
+        profile = await profiler.run_cprofile(seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    if format == "text":
+        return Response(profile_to_text(profile), media_type="text/plain")
+    return Response(
+        profile_to_bytes(profile),
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": 'attachment; filename="server.prof"'}
+    )
 
 
 # --- Message Functions ---
 
-def save_message(sender: str, recipient: str, content: str, is_delivered: bool):
-    """Save a message to the database."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO messages (sender, recipient, content, is_delivered)
-        VALUES (?, ?, ?, ?)
-    ''', (sender, recipient, content, is_delivered))
-    conn.commit()
-    conn.close()
-
-def get_offline_messages(recipient: str) -> List[tuple]:
-    """Retrieve undelivered messages for a user."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, sender, content, timestamp FROM messages
-        WHERE recipient = ? AND is_delivered = 0
-    ''', (recipient,))
+def offline_cutoff() -> str:
+    """Queued messages with a timestamp before this have outlived the TTL."""
+    cutoff = datetime.utcnow() - timedelta(days=OFFLINE_MESSAGE_TTL_DAYS)
+    return cutoff.strftime("%Y-%m-%d %H:%M:%S")
+
+async def sweep_expired_messages():
+    """Periodically delete expired offline messages for users who never reconnect."""
+    while True:
+        await asyncio.sleep(OFFLINE_SWEEP_INTERVAL_SECONDS)
+        try:
+            expired = storage.expire_offline_messages(offline_cutoff())
+        except Exception as e:
+            # e.g. "database is locked" - try again next interval rather than stop sweeping
+            print(f"Offline message sweep failed: {e!r}")
+            continue
+        if expired:
+            print(f"Expired {expired} offline messages")
+
+def get_offline_messages(recipient: str, sender: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+    """Retrieve undelivered messages for a user (marking them delivered)."""
     formatted_messages = []
-    rows = cursor.fetchall() 
-    
-    for row in rows:
-        msg_id, sender, content, timestamp = row
-        formatted_messages.append({
+    for sender, content, timestamp, attachment_id in storage.take_offline_messages(recipient, sender, limit):
+        message = {
             "from": sender,
             "message": content,
             "timestamp": timestamp,
             "offline_catchup": True
-        })
-        cursor.execute('UPDATE messages SET is_delivered = 1 WHERE id = ?', (msg_id,))
-    
-    conn.commit()
-    conn.close()
+        }
+        if attachment_id:
+            message["attachment"] = attachment_id
+        formatted_messages.append(message)
     return formatted_messages
 
-# Initialize DB on startup
-init_db()
+def get_offline_digest(recipient: str, total: int) -> dict:
+    """Compact "N new messages from X" frame sent instead of a large backlog."""
+    senders = [{"from": sender, "count": count, "latest": latest}
+               for sender, count, latest in storage.get_offline_summary(recipient)]
+    summary = f"{total} new messages from {senders[0]['from']}"
+    if len(senders) == 2:
+        summary += " and 1 other"
+    elif len(senders) > 2:
+        summary += f" and {len(senders) - 1} others"
+    return {"type": "offline_digest", "total": total, "senders": senders, "message": summary}
+
+@app.get("/api/offline/{username}")
+async def fetch_offline_messages(username: str, token: str = None, sender: str = None,
+                                 limit: int = OFFLINE_PAGE_SIZE):
+    """Fetch (and mark delivered) a page of queued messages, e.g. after an offline digest."""
+    if not token or verify_token(token) != username:
+        raise HTTPException(status_code=403, detail="Invalid token")
+    
+    limit = max(1, min(limit, OFFLINE_PAGE_SIZE))
+    messages = get_offline_messages(username, sender, limit)
+    # Remaining for the same filter, so a per-contact fetch loop stops when that contact is done
+    return {"messages": messages, "remaining": storage.count_offline_messages(username, sender)}
+
+# --- Connection Admission ---
+def reconnect_delay() -> float:
+    """Pick a jittered reconnect delay so clients don't all come back at once."""
+    jitter = random.uniform(-RECONNECT_JITTER_SECONDS, RECONNECT_JITTER_SECONDS)
+    # Floor only matters if the jitter is configured larger than the base
+    return round(max(1.0, RECONNECT_BASE_SECONDS + jitter), 1)
+
+class ConnectionAdmission:
+    """Token bucket that paces WebSocket handshakes.
+
+    Excess handshakes wait in FIFO order (asyncio.Lock is fair) instead of
+    all hitting JWT checks, offline-message queries and presence broadcasts
+    at once. Once too many are waiting, new ones are rejected immediately.
+    """
+
+    def __init__(self, rate: float, burst: int, max_pending: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_pending = max_pending
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.pending = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> bool:
+        """Wait for a handshake slot. Returns False if the queue is full."""
+        if self.pending >= self.max_pending:
+            return False
+        self.pending += 1
+        try:
+            async with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens < 1:
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+                    # Refill from the real elapsed time: sleeps overshoot, and
+                    # dropping that credit would cap the rate below the setting
+                    now = time.monotonic()
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                self.tokens -= 1
+            return True
+        finally:
+            self.pending -= 1
+
+admission = ConnectionAdmission(MAX_CONNECTS_PER_SECOND, CONNECT_BURST, MAX_PENDING_HANDSHAKES)
 
 # --- Connection Manager ---
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
         self.username_mapping: Dict[str, str] = {}  # normalized -> original
+        self.draining = False  # Set on shutdown; new connections are turned away
 
     async def connect(self, websocket: WebSocket, client_id: str):
         # Normalization: Use lowercase for connection tracking
@@ -635,11 +819,20 @@ class ConnectionManager:
         # Let's trust the DB (SQLite) to match or use what was stored.
         # Actually, if we want robust delivery, we should store normalized.
         # But for now, let's just fix the ONLINE check.
-        pending_msgs = get_offline_messages(client_id)
+        storage.expire_offline_messages(offline_cutoff(), client_id)
+        backlog = storage.count_offline_messages(client_id)
+        if backlog > OFFLINE_DIGEST_THRESHOLD:
+            # Too much to push on connect; the client pulls it from /api/offline
+            await websocket.send_text(json.dumps(get_offline_digest(client_id, backlog)))
+            print(f"Sent offline digest ({backlog} messages) to {client_id}")
+            return
+
+        pending_msgs = get_offline_messages(client_id) if backlog else []
         if pending_msgs:
             print(f"Delivering {len(pending_msgs)} offline messages to {client_id}")
-            for msg in pending_msgs:
-                await websocket.send_text(json.dumps(msg))
+            with profiler.timed("deliver offline messages", client_id):
+                for msg in pending_msgs:
+                    await websocket.send_text(json.dumps(msg))
 
     def disconnect(self, client_id: str):
         client_id_norm = client_id.lower()
@@ -648,17 +841,52 @@ class ConnectionManager:
             del self.username_mapping[client_id_norm]
             print(f"Client {client_id} disconnected.")
     
+    async def drain(self):
+        """Tell every client to reconnect later (with jitter), then close them."""
+        if self.draining:
+            return
+        self.draining = True
+        connections = list(self.active_connections.values())
+        print(f"Draining {len(connections)} connections...")
+
+        async def close(websocket: WebSocket):
+            try:
+                await websocket.send_text(json.dumps({
+                    "type": "reconnect",
+                    "after": reconnect_delay(),
+                    "message": "Server is restarting"
+                }))
+                await websocket.close(code=1012, reason="Server restarting")
+            except:
+                pass  # Connection might already be dead
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(close(ws) for ws in connections)),
+                timeout=DRAIN_TIMEOUT_SECONDS
+            )
+        except asyncio.TimeoutError:
+            print("Drain timed out; remaining connections will be dropped")
+        self.active_connections.clear()
+        self.username_mapping.clear()
+
     async def broadcast_online_users(self):
         """Broadcast list of online users to all connected clients."""
+        if self.draining:
+            return  # Everyone is being disconnected anyway
+
         # Send original usernames (not normalized keys)
         online_list = list(self.username_mapping.values())
         message = json.dumps({"type": "online_users", "users": online_list})
         
-        for websocket in self.active_connections.values():
-            try:
-                await websocket.send_text(message)
-            except:
-                pass  # Ignore errors for disconnected sockets
+        with profiler.timed("broadcast_online_users", len(online_list)):
+            for client_key, websocket in self.active_connections.items():
+                try:
+                    # Flags individual slow sockets
+                    with profiler.timed("send online_users", client_key):
+                        await websocket.send_text(message)
+                except:
+                    pass  # Ignore errors for disconnected sockets
 
     async def send_notification(self, recipient: str, notification: dict):
         """Send a notification to a specific user if they're online."""
@@ -673,35 +901,93 @@ class ConnectionManager:
 
 
 
+    def make_room_in_offline_queue(self, recipient: str) -> bool:
+        """Apply the queue cap before storing an offline message. False means reject it."""
+        queued = storage.count_offline_messages(recipient)
+        if queued < OFFLINE_QUEUE_MAX:
+            return True
+        if OFFLINE_QUEUE_POLICY == "reject":
+            return False
+        storage.drop_oldest_offline_messages(recipient, queued - OFFLINE_QUEUE_MAX + 1)
+        return True
+
+    async def send_error(self, sender_id: str, recipient: str, message_data: dict, error: str):
+        """Tell the sender a message was refused."""
+        sender_ws = self.active_connections.get(sender_id.lower())
+        if sender_ws:
+            await sender_ws.send_text(json.dumps({
+                "type": "error",
+                "to": recipient,
+                "id": message_data.get("id"),  # Client's id for the message, so it can be marked failed
+                "error": error
+            }))
+
     async def handle_message(self, sender_id: str, message_data: dict):
         recipient = message_data.get("to")
-        content = message_data.get("message")
+        content = message_data.get("message") or ""
+        # Files are uploaded via /api/attachments; messages only carry the id
+        attachment_id = message_data.get("attachment")
+        if not isinstance(attachment_id, str):
+            attachment_id = None
         
-        if not recipient or not content:
+        if not recipient or not (content or attachment_id):
             return
 
+        # Only your own uploads can be attached (re-uploading someone else's
+        # file is free: the store is content-addressed)
+        if attachment_id:
+            attachment = storage.get_attachment(attachment_id)
+            if not attachment or attachment[4] != sender_id:
+                await self.send_error(sender_id, recipient, message_data, "Unknown attachment")
+                print(f"Rejected (Bad attachment) {sender_id} -> {recipient}")
+                return
+        
         # CHECK IF ONLINE (Case Insensitive)
         recipient_norm = recipient.lower()
         is_online = recipient_norm in self.active_connections
         
+        # 0. ENFORCE OFFLINE QUEUE CAP
+        if not is_online and not self.make_room_in_offline_queue(recipient):
+            await self.send_error(sender_id, recipient, message_data,
+                                  f"{recipient} has too many unread messages")
+            print(f"Rejected (Queue full) {sender_id} -> {recipient}")
+            return
+        
         # 1. SAVE TO DB (Preserve original casing for display?)
-        save_message(sender_id, recipient, content, is_delivered=is_online)
+        storage.save_message(sender_id, recipient, content, is_delivered=is_online, attachment_id=attachment_id)
         
         # 2. DELIVER IF ONLINE
         if is_online:
             websocket = self.active_connections[recipient_norm]
-            await websocket.send_text(json.dumps({
-                "from": sender_id, 
-                "message": content
-            }))
+            payload = {"from": sender_id, "message": content}
+            if attachment_id:
+                payload["attachment"] = attachment_id
+            await websocket.send_text(json.dumps(payload))
             print(f"Sent (Online) {sender_id} -> {recipient}")
         else:
             print(f"Stored (Offline) {sender_id} -> {recipient}")
 
 manager = ConnectionManager()
 
+async def reject_connection(websocket: WebSocket):
+    """Turn a client away with a jittered reconnect hint (1013 = Try Again Later)."""
+    await websocket.accept()
+    await websocket.send_text(json.dumps({
+        "type": "reconnect",
+        "after": reconnect_delay(),
+        "message": "Server is busy, please reconnect later"
+    }))
+    await websocket.close(code=1013, reason="Try again later")
+
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str, token: str = None):
+    # Pace handshakes so a mass reconnect doesn't stampede auth/DB/presence
+    # (re-check draining: shutdown may have started while we were queued)
+    admitted = not manager.draining and await admission.acquire()
+    if not admitted or manager.draining:
+        await reject_connection(websocket)
+        return
+
     # Verify authentication
     if not token:
         await websocket.close(code=1008, reason="Authentication required")
@@ -712,7 +998,8 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str, token: str =
         await websocket.close(code=1008, reason="Invalid token")
         return
     
-    await manager.connect(websocket, client_id)
+    with profiler.timed("connect", client_id):
+        await manager.connect(websocket, client_id)
     await manager.broadcast_online_users()  # Notify all clients
     
     try:
@@ -720,7 +1007,8 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str, token: str =
             data = await websocket.receive_text()
             try:
                 message_data = json.loads(data)
-                await manager.handle_message(client_id, message_data)
+                with profiler.timed("handle_message", client_id):
+                    await manager.handle_message(client_id, message_data)
             except json.JSONDecodeError:
                 pass
     except WebSocketDisconnect:
@@ -728,7 +1016,33 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str, token: str =
         await manager.broadcast_online_users()  # Notify all clients
 
 
+@app.get("/{full_path:path}")
+async def spa_fallback(request: Request, full_path: str):
+    """Serve index.html for client-side routes; unknown API/asset paths stay 404."""
+    if full_path.startswith(("api/", "assets/", "ws/")):
+        raise HTTPException(status_code=404, detail="Not found")
+    # Real files at the top of the build (favicon, vite.svg, ...)
+    candidate = os.path.realpath(os.path.join(STATIC_DIR, full_path))
+    static_root = os.path.realpath(STATIC_DIR)
+    if candidate.startswith(static_root + os.sep) and os.path.isfile(candidate):
+        return FileResponse(candidate, headers={"Cache-Control": "no-cache"})
+    return index_cache.response(request)
+
+
 if __name__ == "__main__":
     import uvicorn
+
+    class ChatServer(uvicorn.Server):
+        """uvicorn server that drains WebSocket clients before closing sockets.
+
+        `uvicorn server:app` uses the stock Server, which closes WebSockets
+        with 1012 and no reconnect hint, so clients retry on their own timer.
+        """
+
+        async def shutdown(self, sockets=None):
+            await manager.drain()
+            await super().shutdown(sockets=sockets)
+
     # Allow external access via 0.0.0.0 and use port 8001 (matching previous session)
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    config = uvicorn.Config(app, host="0.0.0.0", port=8001, timeout_graceful_shutdown=DRAIN_TIMEOUT_SECONDS)
+    ChatServer(config).run()
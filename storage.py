@@ -0,0 +1,748 @@
+"""Storage backends for the chat server.
+
+`Storage` is the interface server.py talks to. `SQLiteStorage` is the
+production engine; `MemoryStorage` keeps everything in process and is
+used for tests and benchmarks where disk I/O would only add noise.
+
+Rows are returned as plain tuples (like sqlite3 does) so the server can
+format them for the wire however it likes.
+"""
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import count
+from typing import Deque, Dict, Iterator, List, Optional, Set, Tuple
+import sqlite3
+
+
+def utc_timestamp() -> str:
+    """Current UTC time in SQLite's CURRENT_TIMESTAMP format."""
+    return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class Storage(ABC):
+    """Interface for users, messages, friendships and the offline queue."""
+
+    # --- Users ---
+
+    @abstractmethod
+    def user_exists(self, username: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def create_user(self, username: str, password_hash: str, recovery_key_hash: str) -> bool:
+        """Create a user. Returns False if the username is taken."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_password_hash(self, username: str) -> Optional[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_recovery_key_hash(self, username: str) -> Optional[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_password_hash(self, username: str, password_hash: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_recovery_key_hash(self, username: str, recovery_key_hash: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def search_users(self, query: str, limit: int = 10) -> List[str]:
+        """Usernames containing `query` (case-insensitive)."""
+        raise NotImplementedError
+
+    # --- Messages ---
+
+    @abstractmethod
+    def save_message(self, sender: str, recipient: str, content: str, is_delivered: bool,
+                     attachment_id: Optional[str] = None) -> int:
+        """Store a message and return its id."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_history(self, username: str) -> List[Tuple]:
+        """(sender, recipient, content, timestamp, is_delivered, attachment_id) rows, oldest first."""
+        raise NotImplementedError
+
+    # --- Offline queue ---
+
+    @abstractmethod
+    def take_offline_messages(self, recipient: str, sender: Optional[str] = None,
+                              limit: Optional[int] = None) -> List[Tuple]:
+        """Return (sender, content, timestamp, attachment_id) for undelivered messages, oldest first,
+        and mark them delivered. Optionally only from one sender and/or only the first `limit`."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_offline_messages(self, recipient: str, sender: Optional[str] = None) -> int:
+        """Undelivered messages for a recipient, optionally only from one sender."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_offline_summary(self, recipient: str) -> List[Tuple]:
+        """(sender, count, latest_timestamp) per sender of undelivered messages."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def drop_oldest_offline_messages(self, recipient: str, count: int):
+        """Delete the `count` oldest undelivered messages for a recipient.
+
+        Deleted, not just hidden: they also leave the sender's history."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def expire_offline_messages(self, cutoff: str, recipient: Optional[str] = None) -> int:
+        """Delete undelivered messages older than `cutoff` (a UTC timestamp), from both
+        participants' history. Returns how many."""
+        raise NotImplementedError
+
+    # --- Attachments ---
+
+    @abstractmethod
+    def save_attachment(self, attachment_id: str, sha256: str, filename: str, content_type: str,
+                        size: int, uploader: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_attachment(self, attachment_id: str) -> Optional[Tuple]:
+        """(sha256, filename, content_type, size, uploader) or None."""
+        raise NotImplementedError
+
+    # --- Friendships ---
+
+    @abstractmethod
+    def get_friendship_status(self, user_a: str, user_b: str) -> Optional[str]:
+        """Status of any request between the two users, in either direction."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def create_friend_request(self, sender: str, recipient: str) -> bool:
+        """Create a pending request. Returns False if one already exists."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def accept_friend_request(self, sender: str, recipient: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def reject_friend_request(self, sender: str, recipient: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def block_friend_request(self, sender: str, recipient: str):
+        """Mark an existing request from `sender` to `recipient` as blocked."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_pending_requests(self, username: str) -> List[Tuple]:
+        """Incoming (sender, created_at) pending requests, newest first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_friends(self, username: str) -> List[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove_friend(self, username: str, friend: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def block_user(self, username: str, blocked_user: str):
+        """Block a user, replacing any existing request from `username`."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def unblock_user(self, username: str, blocked_user: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_blocked_users(self, username: str) -> List[str]:
+        raise NotImplementedError
+
+
+class SQLiteStorage(Storage):
+    """SQLite engine. Opens a short-lived connection per operation."""
+
+    def __init__(self, db_name: str, connection_factory=sqlite3.Connection):
+        self.db_name = db_name
+        # Swapped for a statement-timing subclass when profiling is enabled
+        self.connection_factory = connection_factory
+        self.init_db()
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_name, factory=self.connection_factory)
+
+    def init_db(self):
+        """Initialize the database with users and messages tables."""
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        # Users table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                username TEXT PRIMARY KEY,
+                password_hash TEXT NOT NULL,
+                recovery_key_hash TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Check if recovery_key_hash column exists (for migration)
+        try:
+            cursor.execute("SELECT recovery_key_hash FROM users LIMIT 1")
+        except sqlite3.OperationalError:
+            cursor.execute("ALTER TABLE users ADD COLUMN recovery_key_hash TEXT")
+            print("Migrated DB: Added recovery_key_hash column")
+
+        # Messages table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sender TEXT,
+                recipient TEXT,
+                content TEXT,
+                is_delivered BOOLEAN,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                attachment_id TEXT
+            )
+        ''')
+
+        # Offline queue lookups (count / catch-up per recipient)
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_messages_offline
+            ON messages (recipient, is_delivered)
+        ''')
+
+        # Check if attachment_id column exists (for migration)
+        try:
+            cursor.execute("SELECT attachment_id FROM messages LIMIT 1")
+        except sqlite3.OperationalError:
+            cursor.execute("ALTER TABLE messages ADD COLUMN attachment_id TEXT")
+            print("Migrated DB: Added attachment_id column")
+
+        # Attachments table (files live in the content-addressed store, keyed by sha256)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS attachments (
+                id TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                filename TEXT,
+                content_type TEXT,
+                size INTEGER,
+                uploader TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Friend requests table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS friend_requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sender TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                status TEXT DEFAULT 'pending',
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(sender, recipient)
+            )
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    # Connections are closed even when a statement fails (e.g. IntegrityError on a
+    # duplicate), otherwise the open write transaction keeps the database locked
+
+    def _fetchone(self, query: str, params: tuple) -> Optional[tuple]:
+        conn = self.connect()
+        try:
+            return conn.execute(query, params).fetchone()
+        finally:
+            conn.close()
+
+    def _fetchall(self, query: str, params: tuple) -> List[tuple]:
+        conn = self.connect()
+        try:
+            return conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+
+    def _execute(self, query: str, params: tuple) -> int:
+        with self._transaction() as conn:
+            return conn.execute(query, params).lastrowid
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Connection for multi-statement writes: committed on success, always closed."""
+        conn = self.connect()
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    # --- Users ---
+
+    def user_exists(self, username: str) -> bool:
+        return self._fetchone("SELECT 1 FROM users WHERE username = ?", (username,)) is not None
+
+    def create_user(self, username: str, password_hash: str, recovery_key_hash: str) -> bool:
+        try:
+            self._execute("INSERT INTO users (username, password_hash, recovery_key_hash) VALUES (?, ?, ?)",
+                          (username, password_hash, recovery_key_hash))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def get_password_hash(self, username: str) -> Optional[str]:
+        row = self._fetchone("SELECT password_hash FROM users WHERE username = ?", (username,))
+        return row[0] if row else None
+
+    def get_recovery_key_hash(self, username: str) -> Optional[str]:
+        row = self._fetchone("SELECT recovery_key_hash FROM users WHERE username = ?", (username,))
+        return row[0] if row else None
+
+    def set_password_hash(self, username: str, password_hash: str):
+        self._execute("UPDATE users SET password_hash = ? WHERE username = ?", (password_hash, username))
+
+    def set_recovery_key_hash(self, username: str, recovery_key_hash: str):
+        self._execute("UPDATE users SET recovery_key_hash = ? WHERE username = ?", (recovery_key_hash, username))
+
+    def search_users(self, query: str, limit: int = 10) -> List[str]:
+        # Literal substring match: % and _ in the query are not wildcards
+        escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        rows = self._fetchall('''
+            SELECT username FROM users
+            WHERE LOWER(username) LIKE LOWER(?) ESCAPE '\\'
+            LIMIT ?
+        ''', (f'%{escaped}%', limit))
+        return [row[0] for row in rows]
+
+    # --- Messages ---
+
+    def save_message(self, sender: str, recipient: str, content: str, is_delivered: bool,
+                     attachment_id: Optional[str] = None) -> int:
+        return self._execute('''
+            INSERT INTO messages (sender, recipient, content, is_delivered, attachment_id)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (sender, recipient, content, is_delivered, attachment_id))
+
+    def get_history(self, username: str) -> List[Tuple]:
+        return self._fetchall('''
+            SELECT sender, recipient, content, timestamp, is_delivered, attachment_id
+            FROM messages
+            WHERE sender = ? OR recipient = ?
+            ORDER BY timestamp ASC
+        ''', (username, username))
+
+    # --- Offline queue ---
+
+    def take_offline_messages(self, recipient: str, sender: Optional[str] = None,
+                              limit: Optional[int] = None) -> List[Tuple]:
+        query = '''
+            SELECT id, sender, content, timestamp, attachment_id FROM messages
+            WHERE recipient = ? AND is_delivered = 0
+        '''
+        params = [recipient]
+        if sender is not None:
+            query += " AND sender = ?"
+            params.append(sender)
+        query += " ORDER BY id ASC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        with self._transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            cursor.executemany('UPDATE messages SET is_delivered = 1 WHERE id = ?', [(row[0],) for row in rows])
+        return [row[1:] for row in rows]
+
+    def count_offline_messages(self, recipient: str, sender: Optional[str] = None) -> int:
+        query = "SELECT COUNT(*) FROM messages WHERE recipient = ? AND is_delivered = 0"
+        params = [recipient]
+        if sender is not None:
+            query += " AND sender = ?"
+            params.append(sender)
+        return self._fetchone(query, params)[0]
+
+    def get_offline_summary(self, recipient: str) -> List[Tuple]:
+        return self._fetchall('''
+            SELECT sender, COUNT(*), MAX(timestamp) FROM messages
+            WHERE recipient = ? AND is_delivered = 0
+            GROUP BY sender
+            ORDER BY COUNT(*) DESC
+        ''', (recipient,))
+
+    def drop_oldest_offline_messages(self, recipient: str, count: int):
+        self._execute('''
+            DELETE FROM messages WHERE id IN (
+                SELECT id FROM messages
+                WHERE recipient = ? AND is_delivered = 0
+                ORDER BY id ASC
+                LIMIT ?
+            )
+        ''', (recipient, count))
+
+    def expire_offline_messages(self, cutoff: str, recipient: Optional[str] = None) -> int:
+        query = "DELETE FROM messages WHERE is_delivered = 0 AND timestamp < ?"
+        params = [cutoff]
+        if recipient is not None:
+            query += " AND recipient = ?"
+            params.append(recipient)
+        with self._transaction() as conn:
+            return conn.execute(query, params).rowcount
+
+    # --- Attachments ---
+
+    def save_attachment(self, attachment_id: str, sha256: str, filename: str, content_type: str,
+                        size: int, uploader: str):
+        self._execute('''
+            INSERT INTO attachments (id, sha256, filename, content_type, size, uploader)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (attachment_id, sha256, filename, content_type, size, uploader))
+
+    def get_attachment(self, attachment_id: str) -> Optional[Tuple]:
+        return self._fetchone('''
+            SELECT sha256, filename, content_type, size, uploader FROM attachments WHERE id = ?
+        ''', (attachment_id,))
+
+    # --- Friendships ---
+
+    def get_friendship_status(self, user_a: str, user_b: str) -> Optional[str]:
+        row = self._fetchone('''
+            SELECT status FROM friend_requests
+            WHERE (sender = ? AND recipient = ?) OR (sender = ? AND recipient = ?)
+        ''', (user_a, user_b, user_b, user_a))
+        return row[0] if row else None
+
+    def create_friend_request(self, sender: str, recipient: str) -> bool:
+        try:
+            self._execute('''
+                INSERT INTO friend_requests (sender, recipient, status)
+                VALUES (?, ?, 'pending')
+            ''', (sender, recipient))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def accept_friend_request(self, sender: str, recipient: str):
+        self._execute('''
+            UPDATE friend_requests
+            SET status = 'accepted'
+            WHERE sender = ? AND recipient = ? AND status = 'pending'
+        ''', (sender, recipient))
+
+    def reject_friend_request(self, sender: str, recipient: str):
+        self._execute('''
+            DELETE FROM friend_requests
+            WHERE sender = ? AND recipient = ? AND status = 'pending'
+        ''', (sender, recipient))
+
+    def block_friend_request(self, sender: str, recipient: str):
+        self._execute('''
+            UPDATE friend_requests
+            SET status = 'blocked'
+            WHERE sender = ? AND recipient = ?
+        ''', (sender, recipient))
+
+    def get_pending_requests(self, username: str) -> List[Tuple]:
+        return self._fetchall('''
+            SELECT sender, created_at FROM friend_requests
+            WHERE recipient = ? AND status = 'pending'
+            ORDER BY created_at DESC
+        ''', (username,))
+
+    def get_friends(self, username: str) -> List[str]:
+        rows = self._fetchall('''
+            SELECT sender, recipient FROM friend_requests
+            WHERE (sender = ? OR recipient = ?) AND status = 'accepted'
+        ''', (username, username))
+        # Remove duplicates
+        return list({row[1] if row[0] == username else row[0] for row in rows})
+
+    def remove_friend(self, username: str, friend: str):
+        self._execute('''
+            DELETE FROM friend_requests
+            WHERE ((sender = ? AND recipient = ?) OR (sender = ? AND recipient = ?))
+            AND status = 'accepted'
+        ''', (username, friend, friend, username))
+
+    def block_user(self, username: str, blocked_user: str):
+        self._execute('''
+            INSERT OR REPLACE INTO friend_requests (sender, recipient, status)
+            VALUES (?, ?, 'blocked')
+        ''', (username, blocked_user))
+
+    def unblock_user(self, username: str, blocked_user: str):
+        self._execute('''
+            DELETE FROM friend_requests
+            WHERE sender = ? AND recipient = ? AND status = 'blocked'
+        ''', (username, blocked_user))
+
+    def get_blocked_users(self, username: str) -> List[str]:
+        rows = self._fetchall('''
+            SELECT recipient FROM friend_requests
+            WHERE sender = ? AND status = 'blocked'
+        ''', (username,))
+        return [row[0] for row in rows]
+
+
+# --- In-memory engine ---
+
+class UserRecord:
+    __slots__ = ("password_hash", "recovery_key_hash", "created_at")
+
+    def __init__(self, password_hash: str, recovery_key_hash: Optional[str]):
+        self.password_hash = password_hash
+        self.recovery_key_hash = recovery_key_hash
+        self.created_at = utc_timestamp()
+
+
+class MessageRecord:
+    __slots__ = ("id", "sender", "recipient", "content", "is_delivered", "timestamp", "attachment_id")
+
+    def __init__(self, id: int, sender: str, recipient: str, content: str, is_delivered: bool,
+                 attachment_id: Optional[str] = None):
+        self.id = id
+        self.sender = sender
+        self.recipient = recipient
+        self.content = content
+        self.is_delivered = is_delivered
+        self.timestamp = utc_timestamp()
+        self.attachment_id = attachment_id
+
+
+class AttachmentRecord:
+    __slots__ = ("sha256", "filename", "content_type", "size", "uploader", "created_at")
+
+    def __init__(self, sha256: str, filename: str, content_type: str, size: int, uploader: str):
+        self.sha256 = sha256
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+        self.uploader = uploader
+        self.created_at = utc_timestamp()
+
+
+class FriendRequestRecord:
+    __slots__ = ("sender", "recipient", "status", "created_at")
+
+    def __init__(self, sender: str, recipient: str, status: str):
+        self.sender = sender
+        self.recipient = recipient
+        self.status = status
+        self.created_at = utc_timestamp()
+
+
+class MemoryStorage(Storage):
+    """Pure in-memory engine with the same semantics as SQLiteStorage.
+
+    Messages are indexed per participant so history lookups don't scan
+    everything, and undelivered messages sit in a per-recipient deque.
+    """
+
+    def __init__(self):
+        self.users: Dict[str, UserRecord] = {}
+        self.message_ids = count(1)
+        # Keyed by message id (insertion order = oldest first) so dropped messages can be removed
+        self.messages_by_user: Dict[str, Dict[int, MessageRecord]] = {}
+        self.offline: Dict[str, Deque[MessageRecord]] = {}
+        self.attachments: Dict[str, AttachmentRecord] = {}
+        self.friend_requests: Dict[Tuple[str, str], FriendRequestRecord] = {}
+        self.requests_by_user: Dict[str, Set[Tuple[str, str]]] = {}
+
+    # --- Users ---
+
+    def user_exists(self, username: str) -> bool:
+        return username in self.users
+
+    def create_user(self, username: str, password_hash: str, recovery_key_hash: str) -> bool:
+        if username in self.users:
+            return False
+        self.users[username] = UserRecord(password_hash, recovery_key_hash)
+        return True
+
+    def get_password_hash(self, username: str) -> Optional[str]:
+        user = self.users.get(username)
+        return user.password_hash if user else None
+
+    def get_recovery_key_hash(self, username: str) -> Optional[str]:
+        user = self.users.get(username)
+        return user.recovery_key_hash if user else None
+
+    def set_password_hash(self, username: str, password_hash: str):
+        if username in self.users:
+            self.users[username].password_hash = password_hash
+
+    def set_recovery_key_hash(self, username: str, recovery_key_hash: str):
+        if username in self.users:
+            self.users[username].recovery_key_hash = recovery_key_hash
+
+    def search_users(self, query: str, limit: int = 10) -> List[str]:
+        query = query.lower()
+        results = []
+        for username in self.users:
+            if query in username.lower():
+                results.append(username)
+                if len(results) >= limit:
+                    break
+        return results
+
+    # --- Messages ---
+
+    def save_message(self, sender: str, recipient: str, content: str, is_delivered: bool,
+                     attachment_id: Optional[str] = None) -> int:
+        message = MessageRecord(next(self.message_ids), sender, recipient, content, is_delivered, attachment_id)
+        self.messages_by_user.setdefault(sender, {})[message.id] = message
+        self.messages_by_user.setdefault(recipient, {})[message.id] = message
+        if not is_delivered:
+            self.offline.setdefault(recipient, deque()).append(message)
+        return message.id
+
+    def get_history(self, username: str) -> List[Tuple]:
+        return [(m.sender, m.recipient, m.content, m.timestamp, int(m.is_delivered), m.attachment_id)
+                for m in self.messages_by_user.get(username, {}).values()]
+
+    def _delete_message(self, message: MessageRecord):
+        for username in (message.sender, message.recipient):
+            self.messages_by_user[username].pop(message.id, None)
+
+    # --- Offline queue ---
+
+    def take_offline_messages(self, recipient: str, sender: Optional[str] = None,
+                              limit: Optional[int] = None) -> List[Tuple]:
+        queue = self.offline.get(recipient)
+        if not queue:
+            return []
+        if sender is None and (limit is None or limit >= len(queue)):
+            taken = self.offline.pop(recipient)
+        else:
+            taken, kept = [], deque()
+            for message in queue:
+                if (sender is None or message.sender == sender) and (limit is None or len(taken) < limit):
+                    taken.append(message)
+                else:
+                    kept.append(message)
+            self.offline[recipient] = kept
+        rows = []
+        for message in taken:
+            message.is_delivered = True
+            rows.append((message.sender, message.content, message.timestamp, message.attachment_id))
+        return rows
+
+    def count_offline_messages(self, recipient: str, sender: Optional[str] = None) -> int:
+        queue = self.offline.get(recipient, ())
+        if sender is None:
+            return len(queue)
+        return sum(1 for message in queue if message.sender == sender)
+
+    def get_offline_summary(self, recipient: str) -> List[Tuple]:
+        summary: Dict[str, list] = {}
+        for message in self.offline.get(recipient, ()):
+            entry = summary.setdefault(message.sender, [0, message.timestamp])
+            entry[0] += 1
+            entry[1] = max(entry[1], message.timestamp)
+        rows = [(sender, count, latest) for sender, (count, latest) in summary.items()]
+        rows.sort(key=lambda row: row[1], reverse=True)
+        return rows
+
+    def drop_oldest_offline_messages(self, recipient: str, count: int):
+        queue = self.offline.get(recipient)
+        while queue and count > 0:
+            self._delete_message(queue.popleft())
+            count -= 1
+
+    def expire_offline_messages(self, cutoff: str, recipient: Optional[str] = None) -> int:
+        recipients = [recipient] if recipient is not None else list(self.offline)
+        expired = 0
+        for name in recipients:
+            queue = self.offline.get(name)
+            # Queues are in arrival order, so expired messages are at the front
+            while queue and queue[0].timestamp < cutoff:
+                self._delete_message(queue.popleft())
+                expired += 1
+        return expired
+
+    # --- Attachments ---
+
+    def save_attachment(self, attachment_id: str, sha256: str, filename: str, content_type: str,
+                        size: int, uploader: str):
+        self.attachments[attachment_id] = AttachmentRecord(sha256, filename, content_type, size, uploader)
+
+    def get_attachment(self, attachment_id: str) -> Optional[Tuple]:
+        a = self.attachments.get(attachment_id)
+        return (a.sha256, a.filename, a.content_type, a.size, a.uploader) if a else None
+
+    # --- Friendships ---
+
+    def _add_request(self, sender: str, recipient: str, status: str):
+        key = (sender, recipient)
+        self.friend_requests[key] = FriendRequestRecord(sender, recipient, status)
+        self.requests_by_user.setdefault(sender, set()).add(key)
+        self.requests_by_user.setdefault(recipient, set()).add(key)
+
+    def _delete_request(self, key: Tuple[str, str]):
+        del self.friend_requests[key]
+        for username in key:
+            self.requests_by_user[username].discard(key)
+
+    def _requests_for(self, username: str) -> List[FriendRequestRecord]:
+        return [self.friend_requests[key] for key in self.requests_by_user.get(username, ())]
+
+    def get_friendship_status(self, user_a: str, user_b: str) -> Optional[str]:
+        request = self.friend_requests.get((user_a, user_b)) or self.friend_requests.get((user_b, user_a))
+        return request.status if request else None
+
+    def create_friend_request(self, sender: str, recipient: str) -> bool:
+        if (sender, recipient) in self.friend_requests:
+            return False
+        self._add_request(sender, recipient, 'pending')
+        return True
+
+    def accept_friend_request(self, sender: str, recipient: str):
+        request = self.friend_requests.get((sender, recipient))
+        if request and request.status == 'pending':
+            request.status = 'accepted'
+
+    def reject_friend_request(self, sender: str, recipient: str):
+        request = self.friend_requests.get((sender, recipient))
+        if request and request.status == 'pending':
+            self._delete_request((sender, recipient))
+
+    def block_friend_request(self, sender: str, recipient: str):
+        request = self.friend_requests.get((sender, recipient))
+        if request:
+            request.status = 'blocked'
+
+    def get_pending_requests(self, username: str) -> List[Tuple]:
+        pending = [r for r in self._requests_for(username)
+                   if r.recipient == username and r.status == 'pending']
+        pending.sort(key=lambda r: r.created_at, reverse=True)
+        return [(r.sender, r.created_at) for r in pending]
+
+    def get_friends(self, username: str) -> List[str]:
+        return list({r.recipient if r.sender == username else r.sender
+                     for r in self._requests_for(username) if r.status == 'accepted'})
+
+    def remove_friend(self, username: str, friend: str):
+        for key in ((username, friend), (friend, username)):
+            request = self.friend_requests.get(key)
+            if request and request.status == 'accepted':
+                self._delete_request(key)
+
+    def block_user(self, username: str, blocked_user: str):
+        self._add_request(username, blocked_user, 'blocked')
+
+    def unblock_user(self, username: str, blocked_user: str):
+        request = self.friend_requests.get((username, blocked_user))
+        if request and request.status == 'blocked':
+            self._delete_request((username, blocked_user))
+
+    def get_blocked_users(self, username: str) -> List[str]:
+        return [r.recipient for r in self._requests_for(username)
+                if r.sender == username and r.status == 'blocked']
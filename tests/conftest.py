@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def server_dir(tmp_path_factory):
+    return tmp_path_factory.mktemp("server")
+
+
+@pytest.fixture
+def server(server_dir, monkeypatch):
+    """The server module, run from a temp dir (chat.db and uploads/ are relative to cwd)."""
+    monkeypatch.chdir(server_dir)
+    import server
+    return server
@@ -0,0 +1,150 @@
+"""Connection admission (handshake pacing), overload rejection and shutdown draining."""
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+STAMPEDE = 10_000
+
+
+async def stampede(admission, count: int, duration: float = None) -> tuple:
+    """Start `count` concurrent acquire() calls; returns (admit times, rejected count).
+
+    With a duration, handshakes still queued after that long are cancelled.
+    """
+    admitted, rejected = [], 0
+
+    async def handshake():
+        nonlocal rejected
+        if await admission.acquire():
+            admitted.append(time.monotonic())
+        else:
+            rejected += 1
+
+    start = time.monotonic()
+    tasks = [asyncio.create_task(handshake()) for _ in range(count)]
+    done, pending = await asyncio.wait(tasks, timeout=duration)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    return start, sorted(admitted), rejected
+
+
+def max_excess(start: float, times: list, rate: float) -> float:
+    """Largest number of admissions in any window beyond what `rate` alone allows.
+
+    A token bucket guarantees this never exceeds its burst size.
+    """
+    # admissions in (t_i, t_j] = j - i; allowed by rate = rate * (t_j - t_i)
+    lowest = 0.0  # window starting at the stampede itself
+    excess = 0.0
+    for count, at in enumerate(times, 1):
+        value = count - rate * (at - start)
+        excess = max(excess, value - lowest)
+        lowest = min(lowest, value)
+    return excess
+
+
+def test_stampede_respects_configured_rate(server):
+    admission = server.ConnectionAdmission(
+        server.MAX_CONNECTS_PER_SECOND, server.CONNECT_BURST, server.MAX_PENDING_HANDSHAKES)
+    start, admitted, rejected = asyncio.run(stampede(admission, STAMPEDE, duration=1.0))
+
+    # Everything beyond the pending limit is turned away immediately (the burst
+    # completes without yielding, so it frees its slots for the next few)
+    overflow = STAMPEDE - server.MAX_PENDING_HANDSHAKES
+    assert overflow - server.CONNECT_BURST <= rejected <= overflow
+    # Burst goes through at once, then no faster than the configured rate
+    assert len(admitted) >= server.CONNECT_BURST
+    assert max_excess(start, admitted, server.MAX_CONNECTS_PER_SECOND) <= server.CONNECT_BURST + 1
+    elapsed = admitted[-1] - start
+    assert len(admitted) <= server.CONNECT_BURST + server.MAX_CONNECTS_PER_SECOND * elapsed + 1
+    # Cancelled waiters release their slots
+    assert admission.pending == 0
+
+
+def test_stampede_drains_queue_in_full(server):
+    rate, burst = 20_000, 100
+    admission = server.ConnectionAdmission(rate, burst, max_pending=STAMPEDE)
+    start, admitted, rejected = asyncio.run(stampede(admission, STAMPEDE))
+
+    assert rejected == 0
+    assert len(admitted) == STAMPEDE
+    assert max_excess(start, admitted, rate) <= burst + 1
+    assert admitted[-1] - start >= (STAMPEDE - burst) / rate * 0.95
+
+
+def test_reconnect_delay_window(server):
+    low = server.RECONNECT_BASE_SECONDS - server.RECONNECT_JITTER_SECONDS
+    high = server.RECONNECT_BASE_SECONDS + server.RECONNECT_JITTER_SECONDS
+    assert low >= 1.0  # The floor in reconnect_delay() should never kick in
+    delays = [server.reconnect_delay() for _ in range(10_000)]
+    assert low <= min(delays) and max(delays) <= high
+    assert len(set(delays)) > 100
+
+
+def expect_reconnect(ws, code: int):
+    frame = ws.receive_json()
+    assert frame["type"] == "reconnect"
+    assert frame["after"] >= 1.0
+    with pytest.raises(WebSocketDisconnect) as closed:
+        ws.receive_json()
+    assert closed.value.code == code
+
+
+def test_overflow_gets_reconnect_and_1013(server, monkeypatch):
+    admission = server.ConnectionAdmission(
+        server.MAX_CONNECTS_PER_SECOND, server.CONNECT_BURST, server.MAX_PENDING_HANDSHAKES)
+    admission.pending = server.MAX_PENDING_HANDSHAKES  # Queue already full
+    monkeypatch.setattr(server, "admission", admission)
+    token = server.create_access_token("overflow_user")
+
+    client = TestClient(server.app)
+    with client.websocket_connect(f"/ws/overflow_user?token={token}") as ws:
+        expect_reconnect(ws, 1013)
+    assert "overflow_user" not in server.manager.active_connections
+
+
+def test_connect_while_draining_gets_1013(server, monkeypatch):
+    manager = server.ConnectionManager()
+    manager.draining = True
+    monkeypatch.setattr(server, "manager", manager)
+    token = server.create_access_token("late_user")
+
+    client = TestClient(server.app)
+    with client.websocket_connect(f"/ws/late_user?token={token}") as ws:
+        expect_reconnect(ws, 1013)
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+
+    async def send_text(self, text: str):
+        self.sent.append(json.loads(text))
+
+    async def close(self, code: int = 1000, reason: str = None):
+        self.closed_with = code
+
+
+def test_drain_sends_reconnect_and_1012(server):
+    manager = server.ConnectionManager()
+    sockets = {f"user{i}": FakeWebSocket() for i in range(100)}
+    manager.active_connections.update(sockets)
+
+    asyncio.run(manager.drain())
+
+    assert manager.draining
+    assert manager.active_connections == {}
+    low = server.RECONNECT_BASE_SECONDS - server.RECONNECT_JITTER_SECONDS
+    high = server.RECONNECT_BASE_SECONDS + server.RECONNECT_JITTER_SECONDS
+    for ws in sockets.values():
+        assert [frame["type"] for frame in ws.sent] == ["reconnect"]
+        assert low <= ws.sent[0]["after"] <= high
+        assert ws.closed_with == 1012
+    # Spread out, not one thundering herd
+    assert len({ws.sent[0]["after"] for ws in sockets.values()}) > 10
@@ -0,0 +1,23 @@
+"""Attachment store: which uploads are treated as images."""
+import pytest
+
+import attachments
+from attachments import AttachmentStore, is_raster_image
+
+
+@pytest.mark.parametrize("content_type", ["image/png", "image/JPEG", "image/gif; charset=x", "image/webp"])
+def test_raster_images(content_type):
+    assert is_raster_image(content_type)
+
+
+@pytest.mark.parametrize("content_type", ["image/svg+xml", "image/made-up", "text/html", "application/octet-stream"])
+def test_not_raster_images(content_type):
+    assert not is_raster_image(content_type)
+
+
+@pytest.mark.parametrize("content_type", ["image/svg+xml", "image/made-up", "text/plain"])
+def test_no_thumbnail_job_for_non_raster(tmp_path, monkeypatch, content_type):
+    monkeypatch.setattr(attachments, "Image", object())  # Pretend Pillow is installed
+    store = AttachmentStore(str(tmp_path))
+    store.schedule_thumbnail("0" * 64, content_type)
+    assert store._pool is None
@@ -0,0 +1,64 @@
+"""Offline queue endpoints and the background expiry sweep."""
+import asyncio
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+
+from storage import MemoryStorage
+
+
+@pytest.fixture
+def storage(server, monkeypatch):
+    storage = MemoryStorage()
+    monkeypatch.setattr(server, "storage", storage)
+    return storage
+
+
+def test_remaining_counts_only_the_requested_sender(server, storage):
+    for i in range(3):
+        storage.save_message("alice", "bob", f"a{i}", False)
+    storage.save_message("carol", "bob", "c0", False)
+    token = server.create_access_token("bob")
+    client = TestClient(server.app)
+
+    page = client.get(f"/api/offline/bob?token={token}&sender=alice&limit=2").json()
+    assert [m["message"] for m in page["messages"]] == ["a0", "a1"]
+    assert page["remaining"] == 1
+
+    page = client.get(f"/api/offline/bob?token={token}&sender=alice").json()
+    assert [m["message"] for m in page["messages"]] == ["a2"]
+    assert page["remaining"] == 0  # carol's message doesn't keep alice's loop going
+
+    page = client.get(f"/api/offline/bob?token={token}").json()
+    assert [m["message"] for m in page["messages"]] == ["c0"]
+    assert page["remaining"] == 0
+
+
+def test_offline_requires_own_token(server, storage):
+    token = server.create_access_token("mallory")
+    assert TestClient(server.app).get(f"/api/offline/bob?token={token}").status_code == 403
+
+
+def test_sweep_survives_errors(server, storage, monkeypatch, capsys):
+    calls = []
+
+    def flaky_expire(cutoff, recipient=None):
+        calls.append(cutoff)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return 0
+
+    monkeypatch.setattr(storage, "expire_offline_messages", flaky_expire)
+    monkeypatch.setattr(server, "OFFLINE_SWEEP_INTERVAL_SECONDS", 0)
+
+    async def run_sweeper():
+        task = asyncio.create_task(server.sweep_expired_messages())
+        while len(calls) < 3 and not task.done():
+            await asyncio.sleep(0)
+        assert not task.done()
+        task.cancel()
+
+    asyncio.run(run_sweeper())
+    assert len(calls) == 3
+    assert "database is locked" in capsys.readouterr().out
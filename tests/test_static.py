@@ -0,0 +1,96 @@
+"""Precompressed static assets: generation, negotiation and caching headers."""
+import gzip
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+SOURCE = b"console.log('hello');" * 50
+
+
+def write(path, data: bytes, mtime: float = None):
+    with open(path, "wb") as f:
+        f.write(data)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def assets(tmp_path):
+    write(tmp_path / "index-B3x9_aQz.js", SOURCE)
+    return tmp_path
+
+
+@pytest.fixture
+def client(server, assets):
+    app = FastAPI()
+    app.mount("/assets", server.PrecompressedStaticFiles(directory=str(assets)), name="assets")
+    return TestClient(app)
+
+
+def test_precompress_writes_gzip(server, assets):
+    server.precompress_assets(str(assets))
+    with open(assets / "index-B3x9_aQz.js.gz", "rb") as f:
+        assert gzip.decompress(f.read()) == SOURCE
+
+
+def test_precompress_refreshes_stale_copy(server, assets):
+    source = assets / "index-B3x9_aQz.js"
+    write(str(source) + ".gz", gzip.compress(b"old build"), mtime=1_000_000)
+    os.utime(source, (2_000_000, 2_000_000))
+
+    server.precompress_assets(str(assets))
+    with open(str(source) + ".gz", "rb") as f:
+        assert gzip.decompress(f.read()) == SOURCE
+
+
+def test_precompress_skips_write_failures(server, assets, monkeypatch, capsys):
+    def read_only(*args):
+        raise PermissionError("read-only file system")
+
+    monkeypatch.setattr(server.os, "replace", read_only)
+    server.precompress_assets(str(assets))  # Must not raise
+    assert "Skipping precompression" in capsys.readouterr().out
+    assert not os.path.exists(assets / "index-B3x9_aQz.js.gz")
+
+
+def test_serves_gzip_sibling(server, assets, client):
+    server.precompress_assets(str(assets))
+    response = client.get("/assets/index-B3x9_aQz.js", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.content == SOURCE  # Decoded by the client
+
+
+def test_ignores_stale_sibling(assets, client):
+    source = assets / "index-B3x9_aQz.js"
+    write(str(source) + ".gz", gzip.compress(b"old build"), mtime=1_000_000)
+    os.utime(source, (2_000_000, 2_000_000))
+
+    response = client.get("/assets/index-B3x9_aQz.js", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.content == SOURCE
+
+
+@pytest.mark.parametrize("name, hashed", [
+    ("index-B3x9_aQz.js", True),
+    ("vendor-Ab1-xY_9.css", True),  # Hashes may contain - and _
+    ("my-long-named.js", False),
+    ("app-component.js", False),
+    ("logo.svg", False),
+])
+def test_hashed_asset_names(server, name, hashed):
+    assert bool(server.HASHED_ASSET_RE.search(name)) is hashed
+
+
+def test_cache_headers(assets, client):
+    write(assets / "my-long-named.js", SOURCE)
+    assert client.get("/assets/index-B3x9_aQz.js").headers["cache-control"] == "public, max-age=31536000, immutable"
+    assert client.get("/assets/my-long-named.js").headers["cache-control"] == "no-cache"
+
+
+@pytest.mark.parametrize("suffix", [".gz", ".br"])
+def test_siblings_not_served_directly(server, assets, client, suffix):
+    write(str(assets / "index-B3x9_aQz.js") + suffix, b"compressed bytes")
+    assert client.get(f"/assets/index-B3x9_aQz.js{suffix}").status_code == 404
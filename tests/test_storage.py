@@ -0,0 +1,287 @@
+"""Conformance tests: every Storage engine must behave the same."""
+import sqlite3
+
+import pytest
+
+from storage import MemoryStorage, SQLiteStorage, Storage
+
+PAST = "2000-01-01 00:00:00"
+FUTURE = "2999-01-01 00:00:00"
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def storage(request, tmp_path) -> Storage:
+    if request.param == "sqlite":
+        return SQLiteStorage(str(tmp_path / "chat.db"))
+    return MemoryStorage()
+
+
+def contents(rows, index=2):
+    return [row[index] for row in rows]
+
+
+# --- Users ---
+
+def test_create_user(storage):
+    assert not storage.user_exists("alice")
+    assert storage.create_user("alice", "pw", "rk")
+    assert storage.user_exists("alice")
+    assert storage.get_password_hash("alice") == "pw"
+    assert storage.get_recovery_key_hash("alice") == "rk"
+
+
+def test_create_user_taken(storage):
+    assert storage.create_user("alice", "pw", "rk")
+    assert not storage.create_user("alice", "other", "other")
+    assert storage.get_password_hash("alice") == "pw"
+
+
+def test_unknown_user(storage):
+    assert storage.get_password_hash("nobody") is None
+    assert storage.get_recovery_key_hash("nobody") is None
+
+
+def test_set_hashes(storage):
+    storage.create_user("alice", "pw", "rk")
+    storage.set_password_hash("alice", "pw2")
+    storage.set_recovery_key_hash("alice", "rk2")
+    assert storage.get_password_hash("alice") == "pw2"
+    assert storage.get_recovery_key_hash("alice") == "rk2"
+
+
+def test_search_users(storage):
+    for name in ["Alice", "alicia", "bob"]:
+        storage.create_user(name, "pw", "rk")
+    assert sorted(storage.search_users("ALI")) == ["Alice", "alicia"]
+    assert len(storage.search_users("", limit=2)) == 2
+    assert storage.search_users("zed") == []
+
+
+def test_search_users_is_literal(storage):
+    for name in ["a_b", "axb", "50%off", "back\\slash"]:
+        storage.create_user(name, "pw", "rk")
+    assert storage.search_users("%") == ["50%off"]
+    assert storage.search_users("a_b") == ["a_b"]
+    assert storage.search_users("_") == ["a_b"]
+    assert storage.search_users("k\\s") == ["back\\slash"]
+
+
+# --- Friend requests ---
+
+def test_friend_request_accept(storage):
+    assert storage.get_friendship_status("alice", "bob") is None
+    assert storage.create_friend_request("alice", "bob")
+    assert not storage.create_friend_request("alice", "bob")
+    assert storage.get_friendship_status("bob", "alice") == "pending"
+    assert contents(storage.get_pending_requests("bob"), 0) == ["alice"]
+    assert storage.get_pending_requests("alice") == []
+
+    storage.accept_friend_request("alice", "bob")
+    assert storage.get_friendship_status("alice", "bob") == "accepted"
+    assert storage.get_pending_requests("bob") == []
+    assert storage.get_friends("alice") == ["bob"]
+    assert storage.get_friends("bob") == ["alice"]
+
+    storage.remove_friend("bob", "alice")
+    assert storage.get_friendship_status("alice", "bob") is None
+    assert storage.get_friends("alice") == []
+
+
+def test_friend_request_reject(storage):
+    storage.create_friend_request("alice", "bob")
+    storage.reject_friend_request("alice", "bob")
+    assert storage.get_friendship_status("alice", "bob") is None
+    assert storage.get_pending_requests("bob") == []
+    # Rejected requests can be sent again
+    assert storage.create_friend_request("alice", "bob")
+
+
+def test_accept_only_pending(storage):
+    storage.create_friend_request("alice", "bob")
+    storage.block_friend_request("alice", "bob")
+    storage.accept_friend_request("alice", "bob")
+    storage.reject_friend_request("alice", "bob")
+    assert storage.get_friendship_status("alice", "bob") == "blocked"
+    assert storage.get_friends("bob") == []
+
+
+def test_block_and_unblock(storage):
+    storage.create_friend_request("alice", "bob")
+    storage.accept_friend_request("alice", "bob")
+    storage.block_user("alice", "bob")
+    assert storage.get_friendship_status("alice", "bob") == "blocked"
+    assert storage.get_blocked_users("alice") == ["bob"]
+    assert storage.get_blocked_users("bob") == []
+    assert storage.get_friends("alice") == []
+
+    storage.unblock_user("alice", "bob")
+    assert storage.get_friendship_status("alice", "bob") is None
+    assert storage.get_blocked_users("alice") == []
+
+
+# --- Messages ---
+
+def test_history_order(storage):
+    storage.save_message("alice", "bob", "one", True)
+    storage.save_message("bob", "alice", "two", True)
+    storage.save_message("alice", "carol", "three", False)
+    storage.save_message("alice", "bob", "four", True, attachment_id="att")
+
+    assert contents(storage.get_history("alice")) == ["one", "two", "three", "four"]
+    assert contents(storage.get_history("bob")) == ["one", "two", "four"]
+    assert contents(storage.get_history("carol")) == ["three"]
+
+    sender, recipient, content, timestamp, is_delivered, attachment_id = storage.get_history("bob")[-1]
+    assert (sender, recipient, content, is_delivered, attachment_id) == ("alice", "bob", "four", 1, "att")
+    assert storage.get_history("carol")[0][4] == 0
+
+
+def test_message_to_self(storage):
+    storage.save_message("alice", "alice", "note", True)
+    assert contents(storage.get_history("alice")) == ["note"]
+
+
+def test_save_message_ids(storage):
+    first = storage.save_message("alice", "bob", "one", True)
+    second = storage.save_message("alice", "bob", "two", True)
+    assert second > first
+
+
+# --- Offline queue ---
+
+def queue(storage, messages):
+    for sender, content in messages:
+        storage.save_message(sender, "bob", content, False)
+
+
+def test_take_offline_messages(storage):
+    queue(storage, [("alice", "a1"), ("carol", "c1"), ("alice", "a2")])
+    storage.save_message("alice", "bob", "online", True)
+    assert storage.count_offline_messages("bob") == 3
+
+    rows = storage.take_offline_messages("bob")
+    assert [(row[0], row[1]) for row in rows] == [("alice", "a1"), ("carol", "c1"), ("alice", "a2")]
+    assert storage.count_offline_messages("bob") == 0
+    assert storage.take_offline_messages("bob") == []
+    assert contents(storage.get_history("bob"), 4) == [1, 1, 1, 1]
+
+
+def test_take_offline_by_sender(storage):
+    queue(storage, [("alice", "a1"), ("carol", "c1"), ("alice", "a2")])
+    assert storage.count_offline_messages("bob", sender="alice") == 2
+    assert storage.count_offline_messages("bob", sender="dave") == 0
+    assert contents(storage.take_offline_messages("bob", sender="alice"), 1) == ["a1", "a2"]
+    assert storage.count_offline_messages("bob") == 1
+    assert storage.count_offline_messages("bob", sender="alice") == 0
+    assert contents(storage.take_offline_messages("bob"), 1) == ["c1"]
+
+
+def test_take_offline_with_limit(storage):
+    queue(storage, [("alice", "a1"), ("carol", "c1"), ("alice", "a2"), ("alice", "a3")])
+    assert contents(storage.take_offline_messages("bob", limit=2), 1) == ["a1", "c1"]
+    assert storage.count_offline_messages("bob") == 2
+    assert contents(storage.take_offline_messages("bob", sender="alice", limit=1), 1) == ["a2"]
+    assert contents(storage.take_offline_messages("bob", limit=10), 1) == ["a3"]
+
+
+def test_take_offline_attachment(storage):
+    storage.save_message("alice", "bob", "", False, attachment_id="att")
+    assert storage.take_offline_messages("bob")[0][3] == "att"
+
+
+def test_offline_summary(storage):
+    queue(storage, [("alice", "a1"), ("carol", "c1"), ("alice", "a2")])
+    summary = storage.get_offline_summary("bob")
+    assert [(sender, count) for sender, count, latest in summary] == [("alice", 2), ("carol", 1)]
+    assert all(latest for _, _, latest in summary)
+    assert storage.get_offline_summary("alice") == []
+
+
+def test_drop_oldest(storage):
+    storage.save_message("bob", "alice", "reply", True)
+    queue(storage, [("alice", "a1"), ("alice", "a2"), ("alice", "a3")])
+    storage.drop_oldest_offline_messages("bob", 2)
+
+    assert storage.count_offline_messages("bob") == 1
+    assert contents(storage.take_offline_messages("bob"), 1) == ["a3"]
+    # Dropped messages are deleted, from both participants' history
+    assert contents(storage.get_history("alice")) == ["reply", "a3"]
+    assert contents(storage.get_history("bob")) == ["reply", "a3"]
+
+
+def test_drop_oldest_more_than_queued(storage):
+    queue(storage, [("alice", "a1")])
+    storage.drop_oldest_offline_messages("bob", 5)
+    assert storage.count_offline_messages("bob") == 0
+
+
+def test_expire(storage):
+    queue(storage, [("alice", "a1"), ("alice", "a2")])
+    storage.save_message("alice", "carol", "c1", False)
+    storage.save_message("alice", "bob", "delivered", True)
+
+    assert storage.expire_offline_messages(PAST) == 0
+    assert storage.expire_offline_messages(FUTURE, recipient="bob") == 2
+    assert storage.count_offline_messages("bob") == 0
+    assert storage.count_offline_messages("carol") == 1
+    assert contents(storage.get_history("alice")) == ["c1", "delivered"]
+
+    assert storage.expire_offline_messages(FUTURE) == 1
+    assert storage.count_offline_messages("carol") == 0
+    assert contents(storage.get_history("alice")) == ["delivered"]
+
+
+# --- Attachments ---
+
+def test_attachments(storage):
+    assert storage.get_attachment("missing") is None
+    storage.save_attachment("att", "abc123", "cat.png", "image/png", 42, "alice")
+    assert storage.get_attachment("att") == ("abc123", "cat.png", "image/png", 42, "alice")
+
+
+# --- SQLite connection handling ---
+
+def failing_connection(statement: str):
+    """sqlite3.Connection whose cursors fail on `statement` after it has run (mid-transaction)."""
+
+    class FailingCursor(sqlite3.Cursor):
+        def execute(self, sql, parameters=()):
+            result = super().execute(sql, parameters)
+            if sql.lstrip().startswith(statement):
+                raise sqlite3.OperationalError("injected failure")
+            return result
+
+        def executemany(self, sql, seq_of_parameters):
+            super().executemany(sql, seq_of_parameters)
+            if sql.lstrip().startswith(statement):
+                raise sqlite3.OperationalError("injected failure")
+
+    class FailingConnection(sqlite3.Connection):
+        def cursor(self, factory=FailingCursor):
+            return super().cursor(factory)
+
+        def execute(self, sql, parameters=()):
+            return self.cursor().execute(sql, parameters)
+
+    return FailingConnection
+
+
+@pytest.mark.parametrize("statement, operation", [
+    ("UPDATE messages SET is_delivered", lambda s: s.take_offline_messages("bob")),
+    ("DELETE FROM messages", lambda s: s.expire_offline_messages(FUTURE)),
+])
+def test_failed_write_releases_database(tmp_path, statement, operation):
+    path = str(tmp_path / "chat.db")
+    healthy = SQLiteStorage(path)
+    healthy.save_message("alice", "bob", "queued", False)
+
+    failing = SQLiteStorage(path, connection_factory=failing_connection(statement))
+    with pytest.raises(sqlite3.OperationalError, match="injected"):
+        operation(failing)
+
+    # The failed write was rolled back and its connection closed, so nothing is locked
+    conn = sqlite3.connect(path, timeout=0)
+    conn.execute("INSERT INTO users (username, password_hash) VALUES ('carol', 'pw')")
+    conn.commit()
+    conn.close()
+    assert healthy.count_offline_messages("bob") == 1